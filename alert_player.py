@@ -0,0 +1,200 @@
+"""
+Alert playback that never blocks the control loop.
+
+AlertEngine.alert(room) returns immediately. Each room has its own worker thread, which
+plays the sound on the room's alert sink. Requests that arrive while the room is already
+playing, or less than min_interval after the last alert, are merged into one, so three
+overlapping meetings that the room hasn't joined produce one alert, not three.
+
+The sound is decoded once, at startup, into 16-bit PCM (with ffmpeg or mpg123, or the wave
+module for .wav files). The PCM backends then stream that buffer to the player's stdin
+instead of decoding the MP3 every time. If it can't be decoded they play the file with
+mpg123 instead, and without mpg123 their alerts fail (and are logged). A player that runs
+longer than PLAY_TIMEOUT seconds is killed, so a stuck one can't hold up the room's alerts.
+
+A room's alert_sink chooses the backend. Anything after the first word is passed on to the
+player:
+    aplay [args]        ALSA, plays the preloaded PCM
+    paplay [args]       PulseAudio/PipeWire, plays the preloaded PCM
+    mpg123 [args]       plays the MP3 file
+    afplay [args]       macOS, plays the MP3 file
+    null                logs only
+    file:<path>         appends "<time> <room>" lines to path (for tests)
+Any other command is run with the sound file as its last argument.
+"""
+
+import logging
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+import wave
+
+logger = logging.getLogger(__name__)
+
+RATE = 44100
+CHANNELS = 2
+PLAY_TIMEOUT = 60
+
+
+class Pcm:
+    __slots__ = ('data', 'rate', 'channels')
+
+    def __init__(self, data, rate=RATE, channels=CHANNELS):
+        self.data = data
+        self.rate = rate
+        self.channels = channels
+
+    def __repr__(self):
+        return f"<Pcm {len(self.data)} bytes {self.rate}Hz x{self.channels}>"
+
+
+def load_pcm(sound_file):
+    """Decode sound_file to signed 16-bit little-endian PCM. Returns None if no decoder works."""
+    if sound_file.endswith(".wav"):
+        try:
+            with wave.open(sound_file) as w:
+                if w.getsampwidth() == 2:
+                    return Pcm(w.readframes(w.getnframes()), w.getframerate(), w.getnchannels())
+        except (OSError, wave.Error) as e:
+            logger.warning("Could not read %s: %s", sound_file, e)
+            return None
+    decoders = [
+        ["ffmpeg", "-loglevel", "error", "-i", sound_file, "-f", "s16le", "-ac", str(CHANNELS), "-ar", str(RATE), "-"],
+        ["mpg123", "-q", "-s", "-r", str(RATE), "--stereo", sound_file],
+    ]
+    for cmd in decoders:
+        if not shutil.which(cmd[0]):
+            continue
+        try:
+            data = subprocess.run(cmd, capture_output=True, check=True, timeout=30).stdout
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning("%s could not decode %s: %s", cmd[0], sound_file, e)
+            continue
+        if data:
+            return Pcm(data)
+    return None
+
+
+class Backend:
+    """Plays the alert for one sink spec (see module docstring)."""
+
+    def __init__(self, spec, sound_file, pcm):
+        self.spec = spec
+        self.sound_file = sound_file
+        self.pcm = pcm
+        if spec.startswith("file:"):
+            self.kind, self.path, self.args = "file", spec[len("file:"):], []
+        else:
+            words = shlex.split(spec)
+            self.kind, self.args = words[0], words[1:]
+            if self.kind in ("aplay", "paplay") and pcm is None:
+                # aplay would play the MP3's bytes as raw audio: noise.
+                if shutil.which("mpg123"):
+                    logger.warning("No decoded PCM for %s; playing %s with mpg123 instead", spec, sound_file)
+                else:
+                    logger.error("No decoded PCM for %s and no mpg123 to play %s; its alerts will fail",
+                                 spec, sound_file)
+
+    def command(self):
+        if self.kind == "aplay" and self.pcm:
+            return ["aplay", "-q", "-t", "raw", "-f", "S16_LE",
+                    "-r", str(self.pcm.rate), "-c", str(self.pcm.channels)] + self.args
+        if self.kind == "paplay" and self.pcm:
+            return ["paplay", "--raw", "--format=s16le",
+                    f"--rate={self.pcm.rate}", f"--channels={self.pcm.channels}"] + self.args
+        if self.kind == "mpg123":
+            return ["mpg123", "-q"] + self.args + [self.sound_file]
+        if self.kind in ("aplay", "paplay"):
+            return ["mpg123", "-q", self.sound_file] if shutil.which("mpg123") else None
+        return [self.kind] + self.args + [self.sound_file]
+
+    def play(self, room):
+        if self.kind == "null":
+            return
+        if self.kind == "file":
+            with open(self.path, "a") as f:
+                f.write(f"{time.time():.3f} {room.room_email}\n")
+            return
+        cmd = self.command()
+        if cmd is None:
+            raise RuntimeError(f"{self.spec} has no decoded PCM and there is no mpg123 to play {self.sound_file}")
+        if self.kind in ("aplay", "paplay") and self.pcm:
+            subprocess.run(cmd, input=self.pcm.data, check=False, timeout=PLAY_TIMEOUT)
+        else:
+            subprocess.run(cmd, check=False, timeout=PLAY_TIMEOUT)
+
+
+class RoomPlayer:
+    """Worker thread for one room: plays at most one alert at a time, at most once per min_interval."""
+
+    def __init__(self, room, backend, min_interval, clock=time.monotonic):
+        self.room = room
+        self.backend = backend
+        self.min_interval = min_interval
+        self.clock = clock
+        self.cv = threading.Condition()
+        self.pending = 0            # requests merged into the next alert
+        self.last_played = None
+        self.played = 0
+        self.merged = 0
+        self.thread = threading.Thread(target=self.run, name=f"alert-{room.name}", daemon=True)
+        self.thread.start()
+
+    def request(self):
+        with self.cv:
+            self.pending += 1
+            self.cv.notify()
+
+    def run(self):
+        while True:
+            with self.cv:
+                while not self.pending:
+                    self.cv.wait()
+                if self.last_played is not None:
+                    wait = self.last_played + self.min_interval - self.clock()
+                    if wait > 0:
+                        self.cv.wait(wait)
+                        continue
+                self.merged += self.pending - 1
+                self.pending = 0
+                self.last_played = self.clock()
+            logger.warning("⚠️ Conference room %s has not joined a live meeting!", self.room.name)
+            try:
+                self.backend.play(self.room)
+                self.played += 1
+            except Exception as e:
+                logger.error("Could not play alert in %s: %s", self.room.name, e)
+
+
+class AlertEngine:
+    def __init__(self, sound_file, min_interval=5):
+        self.sound_file = sound_file
+        self.min_interval = min_interval
+        self.pcm = None
+        self.players = {}           # room_email -> RoomPlayer
+        self.backends = {}          # alert_sink -> Backend
+        self.lock = threading.Lock()
+
+    def preload(self, sinks):
+        """Decode the sound once if any of the sinks can use PCM."""
+        if any(s.split()[0] in ("aplay", "paplay") for s in sinks if s):
+            self.pcm = load_pcm(self.sound_file)
+            logger.info("Preloaded alert sound: %s", self.pcm)
+        return self
+
+    def alert(self, room):
+        """Ask for an alert in room. Never blocks."""
+        with self.lock:
+            player = self.players.get(room.room_email)
+            if player is None:
+                backend = self.backends.get(room.alert_sink)
+                if backend is None:
+                    backend = self.backends[room.alert_sink] = Backend(room.alert_sink, self.sound_file, self.pcm)
+                player = self.players[room.room_email] = RoomPlayer(room, backend, self.min_interval)
+        player.request()
+
+    def stats(self):
+        with self.lock:
+            return {email: {'played': p.played, 'merged': p.merged} for email, p in self.players.items()}
@@ -0,0 +1,380 @@
+"""
+Benchmark the event path: Pub/Sub callback -> participant lookup -> join recorded -> alert cancelled.
+
+For each room count, the rooms get a live meeting each (plus some later ones) on the
+emulator, and a synthetic stream of Meet events is pushed straight into the callback that
+start_pubsub_listener() registers. Most joins carry only a participantSession name, as the
+real events do, so they go through the ParticipantResolver. The rest of the stream is
+email-bearing joins, left events (dropped on the attribute fast path), conference.started
+events, events for spaces we don't watch, and duplicate deliveries.
+
+Reported per room count:
+  - callback latency p50/p99/max (microseconds) and events/sec
+  - join-to-decision latency: from a room's join event entering the callback to the alert
+    being cancelled
+  - bytes allocated per event (tracemalloc, measured in a separate pass)
+  - alert_due() latency before any room has joined, and schedule_alerts() latency
+  - peak RSS so far (room counts run in ascending order)
+
+    python benchmark.py --rooms 1 10 100 500 --events 20000 --output bench.json
+
+--transport streaming, pull or push instead publishes the events on the emulator's Pub/Sub
+at --rate events/sec and receives them the way the notifier would (pubsub_listener.py,
+push_receiver.py). It then reports delivery latency, from publish to the callback
+finishing, with events/sec, threads and peak RSS; run each transport in its own process
+so the RSS figures compare.
+
+The output is JSON, so runs can be compared to catch regressions.
+"""
+
+import argparse
+import json
+import logging
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import meeting_notifier
+import quota
+from alert_player import AlertEngine
+from emulator import Emulator, FakeParticipant, VirtualClock
+from meeting_notifier import alert_due, make_callback, schedule_alerts, start_pubsub_listener
+from meeting_state import MeetingRecord, MeetingStore
+from participant_resolver import ParticipantResolver
+from pubsub_listener import start_listener
+from rooms import Room
+from scheduler import AlertScheduler
+
+SUBSCRIPTION = "projects/bench/subscriptions/meet-events-sub"
+TOPIC = "projects/bench/topics/meet-events"
+PREFIX = "google.workspace.meet."
+
+
+class BenchMessage:
+    """The parts of a Pub/Sub message the callback uses, without any bookkeeping cost."""
+    __slots__ = ('message_id', 'publish_time', 'data', 'attributes', 'acked')
+
+    def __init__(self, message_id, data, attributes):
+        self.message_id = message_id
+        self.publish_time = None
+        self.data = data
+        self.attributes = attributes
+        self.acked = None
+
+    def ack(self):
+        self.acked = True
+
+    def nack(self):
+        self.acked = False
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def summary(ns):
+    """Nanosecond samples -> p50/p99/max in microseconds."""
+    return {'p50_us': round(percentile(ns, 50) / 1000, 2) if ns else None,
+            'p99_us': round(percentile(ns, 99) / 1000, 2) if ns else None,
+            'max_us': round(max(ns) / 1000, 2) if ns else None,
+            'count': len(ns)}
+
+
+class Scenario:
+    """n_rooms rooms, each booked into a live meeting and later ones, on an emulator."""
+
+    def __init__(self, n_rooms, meetings_per_room, seed):
+        self.random = random.Random(seed)
+        self.emulator = Emulator(VirtualClock(), seed=seed)
+        self.rooms = [Room(f"Room {i}", f"room{i}@resource.calendar.google.com", alert_sink="null",
+                           meet_user=f"users/room{i}" if i % 2 else None)
+                      for i in range(n_rooms)]
+        now = datetime.now(timezone.utc)
+        records = {}
+        self.live = []              # (space_name, record name, room)
+        for i, room in enumerate(self.rooms):
+            for m in range(meetings_per_room):
+                start = now - timedelta(minutes=5) + timedelta(hours=m)
+                space = self.emulator.book([room], start, 55, f"{room.name} {m}", f"org{i % 7}@example.com")
+                records[space] = MeetingRecord(space, start.isoformat(), (start + timedelta(minutes=55)).isoformat(),
+                                               f"{room.name} {m}", f"org{i % 7}@example.com",
+                                               rooms={room.room_email: room})
+                if m == 0:
+                    self.live.append((space, f"conferenceRecords/{space.split('/')[1]}", room))
+        self.meetings = MeetingStore()
+        self.meetings.replace(records)
+        self.ids = 0
+
+    def message(self, kind, space, payload):
+        self.ids += 1
+        attributes = {'ce-id': f"bench-{self.ids}",
+                      'ce-type': PREFIX + kind,
+                      'ce-subject': f"//meet.googleapis.com/{space}"}
+        return BenchMessage(str(self.ids), json.dumps(payload).encode(), attributes)
+
+    def stream(self, n_events, email_rate=0.1, duplicate_rate=0.05, foreign_rate=0.1):
+        """
+        n_events synthetic messages. Returns [(message, join key or None)]; the join key is
+        (space, room email) for a room's join event.
+        """
+        events = []
+        for space, record, room in self.live:
+            events.append((self.message("conference.v2.started", space, {'conferenceRecord': {'name': record}}), None))
+        guests = 0
+        while len(events) < n_events:
+            space, record, room = self.random.choice(self.live)
+            roll = self.random.random()
+            if roll < foreign_rate:
+                msg = self.message("participant.v2.joined", f"spaces/elsewhere{guests}", {'participantSession': {
+                    'name': f"conferenceRecords/elsewhere/participants/{guests}/participantSessions/1"}})
+                events.append((msg, None))
+            elif roll < foreign_rate + 0.25:
+                msg = self.message("participant.v2.left", space, {'participantSession': {
+                    'name': f"{record}/participants/g{guests}/participantSessions/1"}})
+                events.append((msg, None))
+            elif roll < foreign_rate + 0.45:
+                # The room itself joins (again, for most of them after the first time).
+                participant = FakeParticipant(f"{record}/participants/{room.room_email}",
+                                              room.meet_user, room.display_name)
+                self.emulator.meet.add_participant(participant)
+                if self.random.random() < email_rate:
+                    payload = {'participant': {'emailAddress': room.room_email}}
+                else:
+                    payload = {'participantSession': {'name': f"{participant.name}/participantSessions/1"}}
+                events.append((self.message("participant.v2.joined", space, payload), (space, room.room_email)))
+            else:
+                participant = FakeParticipant(f"{record}/participants/g{guests}", f"users/g{guests}", f"Guest {guests}")
+                self.emulator.meet.add_participant(participant)
+                msg = self.message("participant.v2.joined", space, {'participantSession': {
+                    'name': f"{participant.name}/participantSessions/1"}})
+                events.append((msg, None))
+            guests += 1
+            if self.random.random() < duplicate_rate:
+                msg, key = events[-1]
+                events.append((BenchMessage(msg.message_id, msg.data, msg.attributes), key))
+        return events[:n_events]
+
+
+def setup(scenario):
+    """Wire the real listener, resolver and scheduler to the scenario. Returns (callback, scheduler, alerts, resolver)."""
+    em = scenario.emulator
+    em.pubsub.create_topic(name=TOPIC)
+    em.pubsub.create_subscription(name=SUBSCRIPTION, topic=TOPIC)
+    alerts = AlertEngine(meeting_notifier.MP3_FILE, min_interval=3600)
+    scheduler = AlertScheduler(lambda key: alert_due(scenario.meetings, alerts, key))
+    schedule_alerts(scheduler, scenario.meetings)
+    resolver = ParticipantResolver(em.conference_records_client)
+    start_pubsub_listener(SUBSCRIPTION, scenario.meetings, em, scheduler, resolver)
+    return em.pubsub.callbacks[SUBSCRIPTION], scheduler, alerts, resolver
+
+
+def run_stream(callback, scheduler, events, threads):
+    """Push events through callback. Returns (callback ns samples, join-to-decision ns samples, seconds)."""
+    latencies = [0] * len(events)
+    decisions = []
+
+    def one(i):
+        msg, key = events[i]
+        pending = key is not None and key in scheduler.plans
+        t0 = time.perf_counter_ns()
+        callback(msg)
+        elapsed = time.perf_counter_ns() - t0
+        latencies[i] = elapsed
+        if pending and key not in scheduler.plans:
+            decisions.append(elapsed)
+
+    start = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(one, range(len(events))))
+    else:
+        for i in range(len(events)):
+            one(i)
+    return latencies, decisions, time.perf_counter() - start
+
+
+def run_transport(scenario, callback, events, transport, rate):
+    """
+    Publish events on the emulator at `rate` per second and receive them over `transport`.
+    Returns (publish-to-callback-done ns samples, seconds, threads while running).
+    """
+    pubsub = scenario.emulator.pubsub
+    sent, done = {}, {}
+    expected = len({msg.attributes['ce-id'] for msg, _ in events})
+    finished = threading.Event()
+
+    def timed(message):
+        callback(message)
+        key = message.attributes['ce-id']
+        done[key] = time.perf_counter_ns() - sent[key]
+        if len(done) >= expected:
+            finished.set()
+
+    settings = {'mode': transport, 'port': 0} if transport == 'push' else {'mode': transport}
+    listener = start_listener(pubsub, SUBSCRIPTION, timed, settings)
+    if transport == 'push':
+        pubsub.modify_push_config({'subscription': SUBSCRIPTION, 'push_config': {'push_endpoint': listener.url}})
+    start = time.perf_counter()
+    for i, (msg, _) in enumerate(events):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sent[msg.attributes['ce-id']] = time.perf_counter_ns()
+        pubsub.publish(TOPIC, msg.data, **msg.attributes)
+    threads = threading.active_count()
+    if not finished.wait(60 + len(events) / rate):
+        print(f"{transport}: only {len(done)} of {expected} events arrived", file=sys.stderr)
+    seconds = time.perf_counter() - start
+    listener.stop()
+    return list(done.values()), seconds, threads
+
+
+def allocations(callback, events):
+    """Bytes allocated while handling each event (peak traced memory during the call)."""
+    sizes = []
+    tracemalloc.start()
+    try:
+        for msg, _ in events:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            callback(msg)
+            sizes.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return sizes
+
+
+def bench_transport(n_rooms, args):
+    scenario = Scenario(n_rooms, args.meetings, args.seed)
+    em = scenario.emulator
+    em.pubsub.create_topic(name=TOPIC)
+    em.pubsub.create_subscription(name=SUBSCRIPTION, topic=TOPIC)
+    alerts = AlertEngine(meeting_notifier.MP3_FILE, min_interval=3600)
+    scheduler = AlertScheduler(lambda key: alert_due(scenario.meetings, alerts, key))
+    schedule_alerts(scheduler, scenario.meetings)
+    resolver = ParticipantResolver(em.conference_records_client)
+    callback = make_callback(scenario.meetings, scheduler, resolver)
+    events = scenario.stream(args.events)
+    latencies, seconds, threads = run_transport(scenario, callback, events, args.transport, args.rate)
+    return {
+        'rooms': n_rooms,
+        'transport': args.transport,
+        'events': len(events),
+        'rate': args.rate,
+        'events_per_sec': round(len(latencies) / seconds),
+        'delivery': summary(latencies),
+        'threads': threads,
+        'rooms_joined': sum(len(m.joined) for m in scenario.meetings.snapshot().values()),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def bench(n_rooms, args):
+    if args.transport != 'callback':
+        return bench_transport(n_rooms, args)
+    scenario = Scenario(n_rooms, args.meetings, args.seed)
+    callback, scheduler, alerts, resolver = setup(scenario)
+    events = scenario.stream(args.events)
+
+    # The alert evaluator, while no room has joined yet (the expensive case).
+    keys = [(space, room.room_email) for space, _, room in scenario.live]
+    due = []
+    for key in keys:
+        t0 = time.perf_counter_ns()
+        alert_due(scenario.meetings, alerts, key)
+        due.append(time.perf_counter_ns() - t0)
+
+    latencies, decisions, seconds = run_stream(callback, scheduler, events, args.threads)
+
+    # A fresh copy of the world for the allocation pass, so it sees the same cache misses.
+    scenario2 = Scenario(n_rooms, args.meetings, args.seed)
+    callback2, _, _, _ = setup(scenario2)
+    alloc = allocations(callback2, scenario2.stream(min(args.events, 5000)))
+
+    t0 = time.perf_counter_ns()
+    schedule_alerts(scheduler, scenario.meetings)
+    schedule_ns = time.perf_counter_ns() - t0
+
+    joined = sum(len(m.joined) for m in scenario.meetings.snapshot().values())
+    return {
+        'rooms': n_rooms,
+        'meetings': len(scenario.meetings),
+        'events': len(events),
+        'threads': args.threads,
+        'events_per_sec': round(len(events) / seconds),
+        'callback': summary(latencies),
+        'join_to_decision': summary(decisions),
+        'alloc_bytes_per_event': {'p50': percentile(alloc, 50), 'p99': percentile(alloc, 99),
+                                  'mean': round(sum(alloc) / len(alloc)) if alloc else None},
+        'alert_due': summary(due),
+        'schedule_alerts_us': round(schedule_ns / 1000, 2),
+        'rooms_joined': joined,
+        'participant_api_calls': resolver.api_calls,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rooms", type=int, nargs="+", default=[1, 10, 100, 500])
+    parser.add_argument("--meetings", type=int, default=3, help="meetings per room (the first is live)")
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=1,
+                        help="callback threads (the streaming pull client uses 10 by default)")
+    parser.add_argument("--transport", choices=["callback", "streaming", "pull", "push"], default="callback",
+                        help="call the callback directly, or deliver through Pub/Sub this way")
+    parser.add_argument("--rate", type=float, default=500, help="events/sec published with --transport")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--log-level", default="ERROR",
+                        help="the callback logs every event at INFO; the default leaves that out of the numbers")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    meeting_notifier.logger.setLevel(args.log_level)
+    quota.unlimited()      # the emulator has no quota to protect, and the buckets sleep in real time
+
+    results = {
+        'benchmark': 'meeting_notifier event path',
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': datetime.now(timezone.utc).isoformat(),
+        'args': vars(args),
+        'results': [],
+    }
+    for n in sorted(args.rooms):
+        result = bench(n, args)
+        latency = result.get('callback') or result['delivery']
+        print(f"{n:5d} rooms: {result['events_per_sec']:8d} events/s  "
+              f"p50 {latency['p50_us']}us  p99 {latency['p99_us']}us  "
+              f"rss {result['peak_rss_kb']} KB", file=sys.stderr)
+        results['results'].append(result)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
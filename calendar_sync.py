@@ -0,0 +1,140 @@
+"""
+Incremental sync of a room calendar.
+
+The first refresh() lists the whole window (following nextPageToken) and keeps the
+nextSyncToken that comes back on the last page. After that, each refresh() only asks
+Calendar for what changed since that token and applies the delta to a local index of
+events. If Google invalidates the token (410 Gone) the index is thrown away and seeded
+again.
+
+The window rolls forward. A sync token reports changes anywhere in the calendar, but
+events that were already there and fall in the newly exposed end of the window never show
+up in a delta, so that edge alone is listed; events that ended before the new start are
+dropped. Only a window that moves backwards or jumps past its old end is seeded again.
+"""
+
+import logging
+from datetime import datetime, timezone
+
+from googleapiclient.errors import HttpError
+
+import quota
+
+logger = logging.getLogger(__name__)
+
+
+def event_time(when):
+    """Return an aware datetime for an event 'start' or 'end' field."""
+    if 'dateTime' in when:
+        dt = datetime.fromisoformat(when['dateTime'])
+    else:
+        dt = datetime.fromisoformat(when['date'])
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+class CalendarSync:
+    def __init__(self, calendar_service, calendar_id):
+        self.calendar_service = calendar_service
+        self.calendar_id = calendar_id
+        self.index = {}         # event id -> event resource
+        self.sync_token = None
+        self.window = None      # (time_min, time_max) ISO strings used for the seed
+        self.changed = set()    # event ids added, updated or removed by the last refresh
+
+    def __repr__(self):
+        return f"<CalendarSync {self.calendar_id} {len(self.index)} events>"
+
+    def state(self):
+        return {'sync_token': self.sync_token, 'window': self.window, 'index': self.index}
+
+    def restore(self, state):
+        """Pick up where a previous run left off; the next refresh() is then just a delta."""
+        self.sync_token = state['sync_token']
+        self.window = tuple(state['window']) if state['window'] else None
+        self.index = state['index']
+        self.changed = set()
+
+    def _list(self, **kwargs):
+        """Run events().list() over every page. Returns (items, nextSyncToken)."""
+        items = []
+        page_token = None
+        while True:
+            result = quota.call("calendar.events.list", self.calendar_service.events().list(
+                calendarId=self.calendar_id,
+                singleEvents=True,
+                pageToken=page_token,
+                **kwargs
+            ).execute)
+            items.extend(result.get('items', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return items, result.get('nextSyncToken')
+
+    def seed(self, time_min, time_max):
+        items, self.sync_token = self._list(timeMin=time_min, timeMax=time_max)
+        old_ids = set(self.index)
+        self.index = {e['id']: e for e in items if e.get('status') != 'cancelled'}
+        self.window = (time_min, time_max)
+        self.changed = old_ids | set(self.index)
+        logger.info("Seeded %s: %d events", self.calendar_id, len(self.index))
+
+    def slide(self, time_min, time_max):
+        """
+        Move the window forward to (time_min, time_max) without a seed. Returns the ids of the
+        events added from the new edge, or None if the window can't be slid.
+        """
+        if self.window == (time_min, time_max):
+            return set()
+        old_min, old_max = (datetime.fromisoformat(t) for t in self.window)
+        new_min, new_max = datetime.fromisoformat(time_min), datetime.fromisoformat(time_max)
+        if new_min < old_min or new_max < old_max or new_min > old_max:
+            return None
+        added = set()
+        if new_max > old_max:
+            items, _ = self._list(timeMin=self.window[1], timeMax=time_max)
+            for item in items:
+                if item.get('status') != 'cancelled':
+                    self.index[item['id']] = item
+                    added.add(item['id'])
+        ended = [eid for eid, e in self.index.items() if event_time(e['end']) <= new_min]
+        for eid in ended:
+            del self.index[eid]
+        self.window = (time_min, time_max)
+        logger.debug("Slid %s to %s: %d added, %d dropped", self.calendar_id, time_max, len(added), len(ended))
+        return added | set(ended)
+
+    def refresh(self, time_min, time_max):
+        """Bring the index up to date and return the events inside the window, by start time."""
+        edge = self.slide(time_min, time_max) if self.sync_token is not None and self.window else None
+        if edge is None:
+            self.seed(time_min, time_max)
+        else:
+            try:
+                items, next_token = self._list(syncToken=self.sync_token)
+            except HttpError as e:
+                if e.resp.status != 410:
+                    raise
+                logger.info("Sync token for %s expired; doing a full resync", self.calendar_id)
+                self.seed(time_min, time_max)
+            else:
+                self.changed = edge
+                for item in items:
+                    self.changed.add(item['id'])
+                    if item.get('status') == 'cancelled':
+                        self.index.pop(item['id'], None)
+                    else:
+                        self.index[item['id']] = item
+                if next_token:
+                    self.sync_token = next_token
+                if items:
+                    logger.debug("Applied %d changes to %s", len(items), self.calendar_id)
+        return self.events()
+
+    def events(self):
+        lo = datetime.fromisoformat(self.window[0])
+        hi = datetime.fromisoformat(self.window[1])
+        in_window = [e for e in self.index.values()
+                     if event_time(e['start']) < hi and event_time(e['end']) > lo]
+        return sorted(in_window, key=lambda e: event_time(e['start']))
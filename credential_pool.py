@@ -0,0 +1,214 @@
+"""
+One place to get credentials and API clients.
+
+The service account key is read from disk once. Delegated credentials, Meet clients and
+workspaceevents services are built once per subject (the meeting organizer we
+impersonate) and reused. A background thread refreshes every token a few minutes before
+it expires, so the main loop never waits on a token fetch or signs a JWT itself.
+
+The REST services (Calendar, Workspace Events) are built from a discovery document that is
+parsed once: the copy bundled with googleapiclient, or else one fetched once and kept in
+DISCOVERY_DIR. They all send their requests over one SharedHttp, which keeps a keep-alive
+connection per thread and host, so a poll reuses warm TLS connections instead of opening
+new ones.
+"""
+
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from google.oauth2 import service_account
+
+import metrics
+
+# meet_v2, pubsub_v1 and googleapiclient.discovery are slow to import and not needed until
+# the first client is built, so they are imported in the methods below.
+
+logger = logging.getLogger(__name__)
+
+DISCOVERY_DIR = "discovery_cache"
+
+
+class SharedHttp:
+    """
+    The transport under every REST service: one keep-alive httplib2.Http per thread.
+
+    httplib2.Http is not thread-safe, so it can't simply be shared; but the services on top
+    of it can, since each thread that calls execute() uses its own connections.
+    """
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self.local = threading.local()
+        self.created = 0
+
+    def __repr__(self):
+        return f"<SharedHttp {self.created} connections>"
+
+    def _http(self):
+        http = getattr(self.local, 'http', None)
+        if http is None:
+            import httplib2
+            http = self.local.http = httplib2.Http(timeout=self.timeout)
+            self.created += 1
+        return http
+
+    def request(self, *args, **kwargs):
+        return self._http().request(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # connections, redirect_codes, follow_redirects, ...: those of the calling thread's Http.
+        return getattr(self._http(), name)
+
+
+class CredentialPool:
+    def __init__(self, sa_file, scopes, use_sa=True, oauth_loader=None,
+                 refresh_margin=timedelta(minutes=5)):
+        """
+        :param use_sa: impersonate each organizer with domain-wide delegation; otherwise every
+                       subject gets the user credentials returned by oauth_loader().
+        """
+        with open(sa_file) as f:
+            info = json.load(f)
+        self.sa_credentials = service_account.Credentials.from_service_account_info(info)
+        self.scoped_credentials = self.sa_credentials.with_scopes(scopes)
+        self.use_sa = use_sa
+        self.oauth_loader = oauth_loader
+        self.refresh_margin = refresh_margin
+        self.lock = threading.RLock()
+        self.creds = {}                 # subject -> credentials
+        self.spaces_clients = {}        # subject -> meet_v2.SpacesServiceClient
+        self.records_clients = {}       # subject -> meet_v2.ConferenceRecordsServiceClient
+        self.workspace_services = {}    # subject -> workspaceevents v1 service
+        self.pubsub_clients = {}        # 'publisher' / 'subscriber' -> pubsub_v1 client
+        self.calendar = None            # the Calendar v3 service
+        self.discovery = {}             # (api, version) -> parsed discovery document
+        self.transport = SharedHttp()
+        self.refresher = None
+        self.stopped = threading.Event()
+
+    def credentials(self, subject=None):
+        if not self.use_sa:
+            subject = None
+        with self.lock:
+            if subject not in self.creds:
+                if not self.use_sa:
+                    self.creds[subject] = self.oauth_loader()
+                elif subject:
+                    self.creds[subject] = self.scoped_credentials.with_subject(subject)
+                else:
+                    self.creds[subject] = self.scoped_credentials
+            return self.creds[subject]
+
+    def spaces_client(self, subject=None):
+        with self.lock:
+            key = subject if self.use_sa else None
+            if key not in self.spaces_clients:
+                from google.apps import meet_v2
+                self.spaces_clients[key] = meet_v2.SpacesServiceClient(credentials=self.credentials(subject))
+            return self.spaces_clients[key]
+
+    def conference_records_client(self, subject=None):
+        with self.lock:
+            key = subject if self.use_sa else None
+            if key not in self.records_clients:
+                from google.apps import meet_v2
+                self.records_clients[key] = meet_v2.ConferenceRecordsServiceClient(
+                    credentials=self.credentials(subject))
+            return self.records_clients[key]
+
+    def discovery_document(self, api, version):
+        with self.lock:
+            if (api, version) not in self.discovery:
+                from googleapiclient.discovery_cache import get_static_doc
+                text = get_static_doc(api, version) or self._cached_discovery(api, version)
+                self.discovery[(api, version)] = json.loads(text)
+            return self.discovery[(api, version)]
+
+    def _cached_discovery(self, api, version):
+        """A discovery document this googleapiclient doesn't bundle: fetched once, then read from disk."""
+        path = os.path.join(DISCOVERY_DIR, f"{api}.{version}.json")
+        if not os.path.exists(path):
+            resp, content = self.transport.request(f"https://{api}.googleapis.com/$discovery/rest?version={version}")
+            if resp.status != 200:
+                raise RuntimeError(f"Could not fetch the {api} {version} discovery document: HTTP {resp.status}")
+            os.makedirs(DISCOVERY_DIR, exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(content)
+            logger.info("Saved the %s %s discovery document to %s", api, version, path)
+        with open(path) as f:
+            return f.read()
+
+    def _build(self, api, version, credentials):
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build_from_document
+        return build_from_document(self.discovery_document(api, version),
+                                   http=AuthorizedHttp(credentials, http=self.transport))
+
+    def workspace_events(self, subject=None):
+        with self.lock:
+            key = subject if self.use_sa else None
+            if key not in self.workspace_services:
+                self.workspace_services[key] = self._build('workspaceevents', 'v1', self.credentials(subject))
+            return self.workspace_services[key]
+
+    def calendar_service(self):
+        """The Calendar v3 service, shared by every room (see SharedHttp)."""
+        with self.lock:
+            if self.calendar is None:
+                self.calendar = self._build("calendar", "v3", self.scoped_credentials)
+            return self.calendar
+
+    def publisher(self):
+        with self.lock:
+            if 'publisher' not in self.pubsub_clients:
+                from google.cloud import pubsub_v1
+                self.pubsub_clients['publisher'] = pubsub_v1.PublisherClient(credentials=self.sa_credentials)
+            return self.pubsub_clients['publisher']
+
+    def subscriber(self):
+        with self.lock:
+            if 'subscriber' not in self.pubsub_clients:
+                from google.cloud import pubsub_v1
+                self.pubsub_clients['subscriber'] = pubsub_v1.SubscriberClient(credentials=self.sa_credentials)
+            return self.pubsub_clients['subscriber']
+
+    def _needs_refresh(self, creds):
+        if creds.expiry is None or not creds.token:
+            return True
+        expiry = creds.expiry
+        if expiry.tzinfo is None:
+            expiry = expiry.replace(tzinfo=timezone.utc)
+        return expiry - datetime.now(timezone.utc) < self.refresh_margin
+
+    def refresh_expiring(self):
+        """Refresh every token that expires within refresh_margin."""
+        from google.auth.transport.requests import Request
+        request = Request()
+        with self.lock:
+            # sa_credentials is unscoped: the Pub/Sub clients scope and refresh their own copy.
+            pool = [self.scoped_credentials] + list(self.creds.values())
+        for creds in pool:
+            if not self._needs_refresh(creds):
+                continue
+            try:
+                with metrics.api_call("auth.token_refresh"):
+                    creds.refresh(request)
+            except Exception as e:
+                logger.warning("Token refresh failed for %s: %s",
+                               getattr(creds, '_subject', None) or 'service account', e)
+
+    def start(self, interval=60):
+        """Start the background refresher thread."""
+        def run():
+            while not self.stopped.is_set():
+                self.refresh_expiring()
+                self.stopped.wait(interval)
+        self.refresher = threading.Thread(target=run, name="token-refresher", daemon=True)
+        self.refresher.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,47 @@
+"""
+Suppress duplicate deliveries.
+
+Pub/Sub delivers at least once, and Workspace Events sometimes publishes the same event
+twice a few seconds apart. DedupWindow remembers the ids it has seen for `window` seconds,
+holding at most `max_entries` of them, oldest first out.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class DedupWindow:
+    def __init__(self, window=600, max_entries=10000, clock=time.monotonic):
+        self.window = window
+        self.max_entries = max_entries
+        self.clock = clock
+        self.seen_at = OrderedDict()    # id -> time first seen
+        self.lock = threading.Lock()
+        self.duplicates = 0
+
+    def __len__(self):
+        return len(self.seen_at)
+
+    def seen(self, *ids):
+        """Return True if any of ids was seen within the window; otherwise remember them all."""
+        ids = [i for i in ids if i]
+        now = self.clock()
+        with self.lock:
+            while self.seen_at:
+                oldest, when = next(iter(self.seen_at.items()))
+                if now - when < self.window and len(self.seen_at) <= self.max_entries:
+                    break
+                del self.seen_at[oldest]
+            if any(i in self.seen_at for i in ids):
+                self.duplicates += 1
+                return True
+            for i in ids:
+                self.seen_at[i] = now
+            return False
+
+    def forget(self, *ids):
+        """Forget ids, e.g. when a message is nacked and should be processed on redelivery."""
+        with self.lock:
+            for i in ids:
+                self.seen_at.pop(i, None)
@@ -1,11 +1,12 @@
+import logging
+
 from google.cloud import pubsub_v1
 
+from subscription_reconciler import delete_orphaned_pubsub_subscriptions
+
 PROJECT_ID = "meeting-notifier-412417"
 
-subscriber = pubsub_v1.SubscriberClient()
-subs = subscriber.list_subscriptions(request={"project": f"projects/{PROJECT_ID}"})
+logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 
-for sub in subs:
-    if sub.topic.endswith("_deleted-topic_"):
-        print(f"Deleting orphaned subscription: {sub.name}")
-        subscriber.delete_subscription(request={"subscription": sub.name})
+subscriber = pubsub_v1.SubscriberClient()
+delete_orphaned_pubsub_subscriptions(subscriber, PROJECT_ID)
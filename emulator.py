@@ -0,0 +1,933 @@
+"""
+In-process stand-ins for Calendar, Meet, Workspace Events and Pub/Sub.
+
+Emulator has the same client-getting methods as CredentialPool (calendar_service,
+spaces_client, conference_records_client, workspace_events, publisher, subscriber), so
+`meeting_notifier.py --emulate N` runs the real code paths with no network and no Google
+project. The fakes behave like the real APIs where the notifier depends on it:
+
+  - Calendar events().list() pages its results and hands out sync tokens; a delta returns
+    only what changed (cancelled events included), and expire_sync_tokens() makes the next
+    delta fail with 410 Gone.
+  - Spaces get_space() maps a conferenceId to a space name.
+  - Workspace Events subscriptions can be listed, created, renewed and deleted, and expire
+    after their ttl.
+  - Meet events are only published for spaces with a live subscription, to that
+    subscription's topic, and Pub/Sub delivers them at least once (nacked messages come
+    back after a second; duplicate_rate adds redeliveries). Messages go to the streaming
+    pull's callback, on its scheduler if it has one, are POSTed to a push subscription's
+    endpoint, or wait for pull()/acknowledge(); break_stream() ends a streaming pull with
+    an error.
+  - ConferenceRecords list_conference_records() finds a space's live conference, and
+    get_participant() / list_participants() know who joined and when. The filters the
+    notifier uses (space.name, end_time IS NULL, earliest_start_time >=) are honoured.
+    event_loss drops that fraction of the Meet events, as if they never arrived.
+
+Everything runs on a VirtualClock that can run faster than real time. scripted() books
+meetings on the rooms' calendars for one virtual day and queues their conference.started,
+participant.joined/left and conference.ended events; the joined events only carry a
+participantSession name, as the real ones do.
+
+stats() counts API calls and Pub/Sub traffic, and join_times records when each room
+joined, so alert and join latencies can be measured reproducibly with a fixed seed.
+"""
+
+import heapq
+import http.client
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+EVENT_PREFIX = "google.workspace.meet."
+
+
+def morning(tz='America/New_York', hour=9, lead=300):
+    """Epoch time `lead` seconds before `hour` o'clock today in tz: a good VirtualClock start for scripted()."""
+    zone = pytz.timezone(tz)
+    today = datetime.now(zone)
+    return zone.localize(datetime(today.year, today.month, today.day, hour)).timestamp() - lead
+
+
+class VirtualClock:
+    """time()/sleep() that start at `start` (epoch seconds) and run `speed` times faster than real time."""
+
+    def __init__(self, start=None, speed=1.0):
+        self.origin = time.time() if start is None else start
+        self.t0 = time.monotonic()
+        self.speed = speed
+
+    def time(self):
+        return self.origin + (time.monotonic() - self.t0) * self.speed
+
+    def now(self, tz=timezone.utc):
+        return datetime.fromtimestamp(self.time(), tz)
+
+    def sleep(self, seconds):
+        time.sleep(max(seconds, 0) / self.speed)
+
+    def wait(self, cv, seconds):
+        """cv.wait() for up to `seconds` of virtual time."""
+        return cv.wait(max(seconds, 0) / self.speed)
+
+
+class Request:
+    """What googleapiclient methods return: call execute() to get the result."""
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def execute(self, num_retries=0):
+        return self.func(*self.args, **self.kwargs)
+
+
+def http_error(status, reason):
+    from googleapiclient.errors import HttpError
+    from httplib2 import Response
+    return HttpError(Response({'status': status, 'reason': reason}),
+                     json.dumps({'error': {'code': status, 'message': reason}}).encode())
+
+
+class FakeCalendar:
+    """Calendar v3 events().list() over every room calendar, with sync tokens."""
+
+    def __init__(self, emulator, page_size=250):
+        self.emulator = emulator
+        self.page_size = page_size
+        self.lock = threading.Lock()
+        self.events = {}            # calendar_id -> {event id: event}
+        self.changes = {}           # calendar_id -> [(seq, event id)]
+        self.seq = itertools.count(1)
+        self.last_seq = 0
+        self.token_floor = 0        # sync tokens older than this are Gone
+
+    def put(self, calendar_id, event):
+        """Add or change an event (status 'cancelled' removes it)."""
+        with self.lock:
+            seq = next(self.seq)
+            self.last_seq = seq
+            event = dict(event, etag=f'"{seq}"', updated=self.emulator.clock.now().isoformat())
+            self.events.setdefault(calendar_id, {})[event['id']] = event
+            self.changes.setdefault(calendar_id, []).append((seq, event['id']))
+
+    def cancel(self, calendar_id, event_id):
+        with self.lock:
+            event = self.events.get(calendar_id, {}).get(event_id)
+        if event:
+            self.put(calendar_id, dict(event, status='cancelled'))
+
+    def expire_sync_tokens(self):
+        with self.lock:
+            self.token_floor = self.last_seq + 1
+
+    def list(self, calendarId, singleEvents=True, pageToken=None, syncToken=None,
+             timeMin=None, timeMax=None, **kwargs):
+        self.emulator.count('calendar.events.list')
+        with self.lock:
+            events = self.events.get(calendarId, {})
+            if syncToken is not None:
+                since = int(syncToken)
+                if since < self.token_floor:
+                    raise http_error(410, "Sync token is no longer valid, a full sync is required.")
+                changed = {eid for seq, eid in self.changes.get(calendarId, []) if seq > since}
+                items = [events[eid] for eid in sorted(changed)]
+            else:
+                lo = datetime.fromisoformat(timeMin) if timeMin else None
+                hi = datetime.fromisoformat(timeMax) if timeMax else None
+                items = [e for e in events.values()
+                         if e.get('status') != 'cancelled'
+                         and (hi is None or datetime.fromisoformat(e['start']['dateTime']) < hi)
+                         and (lo is None or datetime.fromisoformat(e['end']['dateTime']) > lo)]
+                items.sort(key=lambda e: (e['start']['dateTime'], e['id']))
+            token = self.last_seq
+        offset = int(pageToken or 0)
+        page = items[offset:offset + self.page_size]
+        result = {'kind': 'calendar#events', 'items': page}
+        if offset + self.page_size < len(items):
+            result['nextPageToken'] = str(offset + self.page_size)
+        else:
+            result['nextSyncToken'] = str(token)
+        return result
+
+
+class FakeCalendarService:
+    def __init__(self, calendar):
+        self.calendar = calendar
+
+    def events(self):
+        return self
+
+    def list(self, **kwargs):
+        return Request(self.calendar.list, **kwargs)
+
+
+class FakeSpace:
+    __slots__ = ('name', 'meeting_code', 'meeting_uri')
+
+    def __init__(self, name, meeting_code):
+        self.name = name
+        self.meeting_code = meeting_code
+        self.meeting_uri = f"https://meet.google.com/{meeting_code}"
+
+
+class FakeUser:
+    __slots__ = ('user', 'display_name')
+
+    def __init__(self, user, display_name):
+        self.user = user
+        self.display_name = display_name
+
+
+class FakeParticipant:
+    """Like meet_v2.Participant: exactly one of signedin_user / anonymous_user is set."""
+
+    def __init__(self, name, user=None, display_name=None):
+        self.name = name
+        self.kind = 'signedin_user' if user else 'anonymous_user'
+        setattr(self, self.kind, FakeUser(user, display_name))
+        self.earliest_start_time = None
+        self.latest_end_time = None
+
+    def __contains__(self, kind):
+        return kind == self.kind
+
+
+class FakeConferenceRecord:
+    __slots__ = ('name', 'space', 'start_time', 'end_time')
+
+    def __init__(self, name, space, start_time):
+        self.name = name
+        self.space = space
+        self.start_time = start_time
+        self.end_time = None
+
+
+class FakeMeet:
+    """SpacesServiceClient and ConferenceRecordsServiceClient in one."""
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self.lock = threading.Lock()
+        self.spaces = {}            # conferenceId -> FakeSpace
+        self.records = {}           # conference record name -> FakeConferenceRecord
+        self.participants = {}      # conference record -> {participant name: FakeParticipant}
+
+    def add_space(self, conference_id, space_name):
+        with self.lock:
+            self.spaces[conference_id] = FakeSpace(space_name, conference_id)
+
+    def get_space(self, name, timeout=None):
+        self.emulator.count('meet.get_space')
+        with self.lock:
+            space = self.spaces.get(name.removeprefix("spaces/"))
+        if space is None:
+            from google.api_core.exceptions import NotFound
+            raise NotFound(f"{name} not found")
+        return space
+
+    def start_record(self, record, space_name):
+        with self.lock:
+            self.records[record] = FakeConferenceRecord(record, space_name, self.emulator.clock.now())
+
+    def end_record(self, record):
+        with self.lock:
+            if record in self.records:
+                self.records[record].end_time = self.emulator.clock.now()
+
+    def list_conference_records(self, request=None):
+        self.emulator.count('meet.list_conference_records')
+        flt = (request or {}).get('filter', "")
+        space = re.search(r'space\.name\s*=\s*"([^"]+)"', flt)
+        with self.lock:
+            return [r for r in self.records.values()
+                    if (not space or r.space == space.group(1))
+                    and not ("end_time IS NULL" in flt and r.end_time is not None)]
+
+    def add_participant(self, participant):
+        with self.lock:
+            record = "/".join(participant.name.split("/")[:2])
+            participant.earliest_start_time = participant.earliest_start_time or self.emulator.clock.now()
+            self.participants.setdefault(record, {})[participant.name] = participant
+
+    def get_participant(self, name):
+        self.emulator.count('meet.get_participant')
+        with self.lock:
+            participant = self.participants.get("/".join(name.split("/")[:2]), {}).get(name)
+        if participant is None:
+            from google.api_core.exceptions import NotFound
+            raise NotFound(f"{name} not found")
+        return participant
+
+    def list_participants(self, parent=None, request=None):
+        self.emulator.count('meet.list_participants')
+        parent = parent or request['parent']
+        since = re.search(r'earliest_start_time\s*>=\s*"([^"]+)"', (request or {}).get('filter', ""))
+        since = datetime.fromisoformat(since.group(1).replace("Z", "+00:00")) if since else None
+        with self.lock:
+            return [p for p in self.participants.get(parent, {}).values()
+                    if since is None or p.earliest_start_time >= since]
+
+
+class FakeWorkspaceEvents:
+    """workspaceevents v1 subscriptions(), shared by every subject."""
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self.lock = threading.Lock()
+        self.subscriptions = {}     # name -> subscription resource (plus 'subject' and 'expires')
+        self.ids = itertools.count(1)
+
+    def for_subject(self, subject):
+        return FakeWorkspaceEventsService(self, subject)
+
+    def live(self, target_resource):
+        """Topics of the unexpired subscriptions on target_resource."""
+        now = self.emulator.clock.time()
+        with self.lock:
+            return [s['notificationEndpoint']['pubsubTopic'] for s in self.subscriptions.values()
+                    if s['targetResource'] == target_resource and s['expires'] > now]
+
+    def list(self, subject, filter=None, pageToken=None, pageSize=50):
+        self.emulator.count('workspaceevents.list')
+        now = self.emulator.clock.time()
+        with self.lock:
+            for name in [n for n, s in self.subscriptions.items() if s['expires'] <= now]:
+                del self.subscriptions[name]
+            mine = sorted((s for s in self.subscriptions.values() if s['subject'] == subject),
+                          key=lambda s: s['name'])
+            offset = int(pageToken or 0)
+            page = mine[offset:offset + pageSize]
+            result = {'subscriptions': [dict(self._strip(s), expireTime=self._expire_time(s)) for s in page]}
+        if offset + pageSize < len(mine):
+            result['nextPageToken'] = str(offset + pageSize)
+        return result
+
+    def _strip(self, sub):
+        return {k: v for k, v in sub.items() if k not in ('subject', 'expires')}
+
+    def _expire_time(self, sub):
+        return datetime.fromtimestamp(sub['expires'], timezone.utc).isoformat()
+
+    def create(self, subject, body):
+        self.emulator.count('workspaceevents.create')
+        ttl = float(body.get('ttl', '86400s').rstrip('s'))
+        with self.lock:
+            for sub in self.subscriptions.values():
+                if (sub['targetResource'] == body['targetResource']
+                        and sub['notificationEndpoint'] == body['notificationEndpoint']):
+                    raise http_error(409, "Subscription already exists")
+            name = f"subscriptions/meet-{next(self.ids)}"
+            sub = dict(body, name=name, state='ACTIVE', subject=subject,
+                       expires=self.emulator.clock.time() + ttl)
+            self.subscriptions[name] = sub
+            public = dict(self._strip(sub), expireTime=self._expire_time(sub))
+        return {'name': f"operations/{name}", 'done': True, 'response': public}
+
+    def patch(self, subject, name, updateMask=None, body=None):
+        self.emulator.count('workspaceevents.patch')
+        with self.lock:
+            sub = self.subscriptions.get(name)
+            if sub is None:
+                raise http_error(404, f"{name} not found")
+            if 'ttl' in (body or {}):
+                sub['expires'] = self.emulator.clock.time() + float(body['ttl'].rstrip('s'))
+            public = dict(self._strip(sub), expireTime=self._expire_time(sub))
+        return {'name': f"operations/{name}", 'done': True, 'response': public}
+
+    def delete(self, subject, name):
+        self.emulator.count('workspaceevents.delete')
+        with self.lock:
+            if self.subscriptions.pop(name, None) is None:
+                raise http_error(404, f"{name} not found")
+        return {'name': f"operations/{name}", 'done': True}
+
+
+class FakeWorkspaceEventsService:
+    def __init__(self, events, subject):
+        self.events = events
+        self.subject = subject
+
+    def subscriptions(self):
+        return self
+
+    def list(self, **kwargs):
+        return Request(self.events.list, self.subject, **kwargs)
+
+    def create(self, **kwargs):
+        return Request(self.events.create, self.subject, **kwargs)
+
+    def patch(self, **kwargs):
+        return Request(self.events.patch, self.subject, **kwargs)
+
+    def delete(self, **kwargs):
+        return Request(self.events.delete, self.subject, **kwargs)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self.events.emulator, callback)
+
+
+class FakeBatch:
+    """What new_batch_http_request() returns: add() requests, then execute() runs them in one go."""
+
+    def __init__(self, emulator, callback=None):
+        self.emulator = emulator
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request, callback or self.callback, request_id or str(len(self.requests) + 1)))
+
+    def execute(self):
+        self.emulator.count('workspaceevents.batch')
+        for request, callback, request_id in self.requests:
+            try:
+                response, exception = request.execute(), None
+            except Exception as e:
+                response, exception = None, e
+            if callback:
+                callback(request_id, response, exception)
+
+
+class FakeMessage:
+    """A received Pub/Sub message."""
+
+    def __init__(self, pubsub, subscription, message_id, data, attributes, publish_time):
+        self.pubsub = pubsub
+        self.subscription = subscription
+        self.message_id = message_id
+        self.data = data
+        self.attributes = attributes
+        self.publish_time = publish_time
+        self.delivery_attempt = 1
+
+    def ack(self):
+        self.pubsub.count('pubsub.ack')
+
+    def nack(self):
+        self.pubsub.count('pubsub.nack')
+        self.pubsub.deliver(self.subscription, self, delay=1)
+
+
+class FakeStreamingPullFuture:
+    def __init__(self, pubsub, subscription):
+        self.pubsub = pubsub
+        self.subscription = subscription
+        self.done_event = threading.Event()
+        self.error = None
+
+    def cancel(self):
+        self.pubsub.unsubscribe(self.subscription)
+        self.done_event.set()
+
+    def fail(self, error):
+        """End the stream with an error, as a dropped connection would."""
+        self.error = error
+        self.cancel()
+
+    def cancelled(self):
+        return self.done_event.is_set()
+
+    def done(self):
+        return self.done_event.is_set()
+
+    def result(self, timeout=None):
+        if not self.done_event.wait(timeout):
+            raise TimeoutError()
+        if self.error:
+            raise self.error
+
+
+class FakeReceivedMessage:
+    __slots__ = ('ack_id', 'message', 'delivery_attempt')
+
+    def __init__(self, ack_id, message):
+        self.ack_id = ack_id
+        self.message = message
+        self.delivery_attempt = message.delivery_attempt
+
+
+class FakePullResponse:
+    __slots__ = ('received_messages',)
+
+    def __init__(self, received_messages):
+        self.received_messages = received_messages
+
+
+class FakeTopic:
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeSubscription:
+    __slots__ = ('name', 'topic')
+
+    def __init__(self, name, topic):
+        self.name = name
+        self.topic = topic
+
+
+class FakeBinding:
+    def __init__(self, role, members):
+        self.role = role
+        self.members = list(members)
+
+
+class FakePolicy:
+    def __init__(self, bindings=()):
+        self.bindings = list(bindings)
+
+
+class FakePubSub:
+    """PublisherClient and SubscriberClient in one, delivering on the virtual clock."""
+
+    def __init__(self, emulator, duplicate_rate=0.0):
+        self.emulator = emulator
+        self.clock = emulator.clock
+        self.duplicate_rate = duplicate_rate
+        self.cv = threading.Condition()
+        self.topics = {}            # topic path -> FakePolicy
+        self.subscriptions = {}     # subscription path -> topic path
+        self.callbacks = {}         # subscription path -> callback
+        self.schedulers = {}        # subscription path -> scheduler the callbacks run on, if any
+        self.streams = {}           # subscription path -> FakeStreamingPullFuture
+        self.backlog = {}           # subscription path -> deque of due messages nobody is streaming
+        self.leased = {}            # ack id -> (subscription path, FakeMessage) pulled but not yet acked
+        self.push_endpoints = {}    # subscription path -> push endpoint URL
+        self.pusher = None
+        self.connections = threading.local()
+        self.queue = []             # (when, seq, subscription path, FakeMessage)
+        self.seq = itertools.count()
+        self.ids = itertools.count(1)
+        self.thread = threading.Thread(target=self.run, name="fake-pubsub", daemon=True)
+        self.thread.start()
+
+    def count(self, what):
+        self.emulator.count(what)
+
+    @staticmethod
+    def topic_path(project, topic):
+        return f"projects/{project}/topics/{topic}"
+
+    @staticmethod
+    def subscription_path(project, subscription):
+        return f"projects/{project}/subscriptions/{subscription}"
+
+    # Publisher
+
+    def get_topic(self, request):
+        with self.cv:
+            if request['topic'] not in self.topics:
+                from google.api_core.exceptions import NotFound
+                raise NotFound(f"{request['topic']} not found")
+        return FakeTopic(request['topic'])
+
+    def create_topic(self, request=None, name=None):
+        name = name or request['name']
+        with self.cv:
+            if name in self.topics:
+                from google.api_core.exceptions import AlreadyExists
+                raise AlreadyExists(f"{name} already exists")
+            self.topics[name] = FakePolicy()
+        return FakeTopic(name)
+
+    def delete_topic(self, request=None, topic=None):
+        topic = topic or request['topic']
+        with self.cv:
+            self.topics.pop(topic, None)
+            for sub, t in self.subscriptions.items():
+                if t == topic:
+                    self.subscriptions[sub] = "_deleted-topic_"
+
+    def get_iam_policy(self, request):
+        with self.cv:
+            return self.topics[request['resource']]
+
+    def set_iam_policy(self, request):
+        with self.cv:
+            self.topics[request['resource']] = request['policy']
+            return request['policy']
+
+    def publish(self, topic, data, **attributes):
+        """Deliver to every subscription on topic, now."""
+        self.count('pubsub.publish')
+        with self.cv:
+            subs = [s for s, t in self.subscriptions.items() if t == topic]
+        message_id = str(next(self.ids))
+        for sub in subs:
+            message = FakeMessage(self, sub, message_id, data, attributes, self.clock.now())
+            self.deliver(sub, message)
+            if self.duplicate_rate and self.emulator.random.random() < self.duplicate_rate:
+                self.count('pubsub.duplicate')
+                self.deliver(sub, FakeMessage(self, sub, message_id, data, attributes, message.publish_time))
+        return message_id
+
+    # Subscriber
+
+    def create_subscription(self, request=None, name=None, topic=None, **kwargs):
+        name = name or request['name']
+        topic = topic or request['topic']
+        with self.cv:
+            if name in self.subscriptions:
+                from google.api_core.exceptions import AlreadyExists
+                raise AlreadyExists(f"{name} already exists")
+            self.subscriptions[name] = topic
+        push_config = kwargs.get('push_config') or (request or {}).get('push_config')
+        if push_config:
+            self.modify_push_config({'subscription': name, 'push_config': push_config})
+        return FakeSubscription(name, topic)
+
+    def modify_push_config(self, request):
+        endpoint = (request.get('push_config') or {}).get('push_endpoint')
+        with self.cv:
+            if endpoint:
+                self.push_endpoints[request['subscription']] = endpoint
+            else:
+                self.push_endpoints.pop(request['subscription'], None)
+            if self.pusher is None:
+                self.pusher = ThreadPoolExecutor(max_workers=16, thread_name_prefix="fake-pubsub-push")
+            self.cv.notify_all()
+
+    def list_subscriptions(self, request):
+        prefix = request['project'] + "/subscriptions/"
+        with self.cv:
+            return [FakeSubscription(s, t) for s, t in self.subscriptions.items() if s.startswith(prefix)]
+
+    def delete_subscription(self, request=None, subscription=None):
+        subscription = subscription or request['subscription']
+        with self.cv:
+            self.subscriptions.pop(subscription, None)
+            self.backlog.pop(subscription, None)
+            self.push_endpoints.pop(subscription, None)
+
+    def subscribe(self, subscription, callback, flow_control=None, scheduler=None):
+        with self.cv:
+            if subscription not in self.subscriptions:
+                from google.api_core.exceptions import NotFound
+                raise NotFound(f"{subscription} not found")
+            self.callbacks[subscription] = callback
+            self.schedulers[subscription] = scheduler
+            future = self.streams[subscription] = FakeStreamingPullFuture(self, subscription)
+            for message in self.backlog.pop(subscription, ()):
+                heapq.heappush(self.queue, (self.clock.time(), next(self.seq), subscription, message))
+            self.cv.notify_all()
+        return future
+
+    def unsubscribe(self, subscription):
+        with self.cv:
+            self.callbacks.pop(subscription, None)
+            self.schedulers.pop(subscription, None)
+            self.streams.pop(subscription, None)
+
+    def break_stream(self, subscription, error=None):
+        """Kill the streaming pull on subscription. Undelivered messages stay queued."""
+        with self.cv:
+            future = self.streams.get(subscription)
+        if future:
+            self.count('pubsub.stream_broken')
+            from google.api_core.exceptions import ServiceUnavailable
+            future.fail(error or ServiceUnavailable("The service was unable to fulfill your request."))
+
+    def pull(self, request, timeout=None):
+        subscription = request['subscription']
+        self.count('pubsub.pull')
+        with self.cv:
+            if subscription not in self.subscriptions:
+                from google.api_core.exceptions import NotFound
+                raise NotFound(f"{subscription} not found")
+            backlog = self.backlog.get(subscription) or deque()
+            received = []
+            while backlog and len(received) < request.get('max_messages', 1):
+                message = backlog.popleft()
+                ack_id = f"ack-{next(self.ids)}"
+                self.leased[ack_id] = (subscription, message)
+                received.append(FakeReceivedMessage(ack_id, message))
+        return FakePullResponse(received)
+
+    def acknowledge(self, request):
+        self.count('pubsub.acknowledge')
+        with self.cv:
+            for ack_id in request['ack_ids']:
+                if self.leased.pop(ack_id, None):
+                    self.count('pubsub.ack')
+
+    def modify_ack_deadline(self, request):
+        self.count('pubsub.modify_ack_deadline')
+        with self.cv:
+            leased = [self.leased.pop(ack_id) for ack_id in request['ack_ids'] if ack_id in self.leased]
+        for subscription, message in leased:
+            self.count('pubsub.nack')
+            message.delivery_attempt += 1
+            self.deliver(subscription, message, delay=request['ack_deadline_seconds'])
+
+    # Delivery
+
+    def deliver(self, subscription, message, delay=0):
+        with self.cv:
+            heapq.heappush(self.queue, (self.clock.time() + delay, next(self.seq), subscription, message))
+            self.cv.notify_all()
+
+    def run(self):
+        while True:
+            with self.cv:
+                while not self.queue:
+                    self.cv.wait()
+                when, _, subscription, message = self.queue[0]
+                wait = when - self.clock.time()
+                if wait > 0:
+                    self.clock.wait(self.cv, wait)
+                    continue
+                heapq.heappop(self.queue)
+                endpoint = self.push_endpoints.get(subscription)
+                if endpoint:
+                    self.pusher.submit(self.push, subscription, endpoint, message)
+                    continue
+                callback = self.callbacks.get(subscription)
+                scheduler = self.schedulers.get(subscription)
+                if callback is None:
+                    if subscription in self.subscriptions:
+                        # Retained for pull(), or until someone subscribes.
+                        self.backlog.setdefault(subscription, deque()).append(message)
+                    continue
+            self.count('pubsub.deliver')
+            if scheduler:
+                scheduler.schedule(callback, message)
+                continue
+            try:
+                callback(message)
+            except Exception as e:
+                logger.error("Callback failed on %s: %s", message.message_id, e)
+
+    def push(self, subscription, endpoint, message):
+        """POST message to a push endpoint, over a kept-alive connection per pusher thread."""
+        from push_receiver import push_envelope
+        url = urlsplit(endpoint)
+        connection = getattr(self.connections, url.netloc, None)
+        self.count('pubsub.push')
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection(url.netloc, timeout=30)
+                setattr(self.connections, url.netloc, connection)
+            target = url.path + (f"?{url.query}" if url.query else "")
+            connection.request("POST", target, push_envelope(message, subscription),
+                               {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            acked = response.status in (102, 200, 201, 202, 204)
+        except (OSError, http.client.HTTPException) as e:
+            logger.debug("Push to %s failed: %s", endpoint, e)
+            connection.close()
+            setattr(self.connections, url.netloc, None)
+            acked = False
+        if acked:
+            self.count('pubsub.ack')
+        else:
+            self.count('pubsub.nack')
+            message.delivery_attempt += 1
+            self.deliver(subscription, message, delay=1)
+
+
+class Emulator:
+    """Fake Google backends with the client-getting interface of CredentialPool."""
+
+    def __init__(self, clock=None, seed=0, duplicate_rate=0.0, event_loss=0.0, use_sa=False):
+        """use_sa: as for CredentialPool. Without it every subject shares one account's subscriptions."""
+        self.clock = clock or VirtualClock()
+        self.use_sa = use_sa
+        self.random = random.Random(seed)
+        self.event_loss = event_loss
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.calendar = FakeCalendar(self)
+        self.meet = FakeMeet(self)
+        self.events = FakeWorkspaceEvents(self)
+        self.pubsub = FakePubSub(self, duplicate_rate)
+        self.sa_credentials = self.scoped_credentials = None
+        self.timeline = []          # (when, seq, action, args) still to happen
+        self.seq = itertools.count()
+        self.meeting_ids = itertools.count()
+        self.join_times = {}        # (space name, room email) -> virtual time the room joined
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def count(self, what):
+        with self.lock:
+            self.calls[what] = self.calls.get(what, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return dict(sorted(self.calls.items()))
+
+    # CredentialPool interface
+
+    def credentials(self, subject=None):
+        return None
+
+    def calendar_service(self):
+        return FakeCalendarService(self.calendar)
+
+    def spaces_client(self, subject=None):
+        return self.meet
+
+    def conference_records_client(self, subject=None):
+        return self.meet
+
+    def workspace_events(self, subject=None):
+        return self.events.for_subject(subject if self.use_sa else None)
+
+    def publisher(self):
+        return self.pubsub
+
+    def subscriber(self):
+        return self.pubsub
+
+    def refresh_expiring(self):
+        pass
+
+    def start(self, interval=None):
+        """Start playing the timeline queued by scripted() / at()."""
+        self.thread = threading.Thread(target=self.run, name="emulator", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    # Scripting
+
+    def at(self, when, action, *args):
+        """Run action(*args) at virtual time `when`."""
+        with self.pubsub.cv:
+            heapq.heappush(self.timeline, (when, next(self.seq), action, args))
+            self.pubsub.cv.notify_all()
+
+    def run(self):
+        cv = self.pubsub.cv
+        while not self.stopped.is_set():
+            with cv:
+                if not self.timeline:
+                    cv.wait(1)
+                    continue
+                wait = self.timeline[0][0] - self.clock.time()
+                if wait > 0:
+                    self.clock.wait(cv, min(wait, 60))
+                    continue
+                _, _, action, args = heapq.heappop(self.timeline)
+            try:
+                action(*args)
+            except Exception as e:
+                logger.error("Emulator action %s failed: %s", getattr(action, '__name__', action), e)
+
+    def meet_event(self, space_name, kind, payload):
+        """Publish a Workspace Events CloudEvent for space_name to every subscribed topic."""
+        target = f"//meet.googleapis.com/{space_name}"
+        topics = self.events.live(target)
+        if not topics:
+            self.count('meet.event_dropped')
+            return
+        if self.event_loss and self.random.random() < self.event_loss:
+            self.count('meet.event_lost')
+            return
+        attributes = {
+            'ce-id': f"{next(self.seq)}",
+            'ce-type': EVENT_PREFIX + kind,
+            'ce-source': "//workspaceevents.googleapis.com/subscriptions/-",
+            'ce-subject': target,
+            'ce-time': self.clock.now().isoformat(),
+            'ce-specversion': "1.0",
+        }
+        data = json.dumps(payload).encode()
+        for topic in topics:
+            self.pubsub.publish(topic, data, **attributes)
+
+    def join(self, space_name, record, participant, room_email=None):
+        self.meet.add_participant(participant)
+        if room_email:
+            self.join_times[(space_name, room_email)] = self.clock.time()
+        self.meet_event(space_name, "participant.v2.joined",
+                        {'participantSession': {'name': f"{participant.name}/participantSessions/1"}})
+
+    def leave(self, space_name, participant):
+        participant.latest_end_time = self.clock.now()
+        self.meet_event(space_name, "participant.v2.left",
+                        {'participantSession': {'name': f"{participant.name}/participantSessions/1"}})
+
+    def book(self, rooms, start, minutes, summary, organizer, room_joins_after=None, guests=2):
+        """
+        Put a meeting on each room's calendar and queue its Meet events.
+        room_joins_after: seconds after start at which the rooms join (None: they never do).
+        """
+        n = next(self.meeting_ids)
+        conference_id = f"emu-{n:05d}"
+        space_name = f"spaces/emu{n:05d}"
+        record = f"conferenceRecords/emu-{n:05d}"
+        end = start + timedelta(minutes=minutes)
+        self.meet.add_space(conference_id, space_name)
+        event = {'id': f"evt{n:05d}",
+                 'status': 'confirmed',
+                 'summary': summary,
+                 'start': {'dateTime': start.isoformat()},
+                 'end': {'dateTime': end.isoformat()},
+                 'creator': {'email': organizer},
+                 'organizer': {'email': organizer},
+                 'conferenceData': {'conferenceId': conference_id, 'signature': f"sig{n:05d}"}}
+        for room in rooms:
+            self.calendar.put(room.calendar_id, event)
+
+        t0, t1 = start.timestamp(), end.timestamp()
+        self.at(t0 - 120, self.meet.start_record, record, space_name)
+        self.at(t0 - 60, self.meet_event, space_name, "conference.v2.started",
+                {'conferenceRecord': {'name': record}})
+        people = [FakeParticipant(f"{record}/participants/{i}", f"users/guest{n}{i}", f"Guest {i}")
+                  for i in range(guests)]
+        for person in people:
+            self.at(t0 - self.random.uniform(0, 120), self.join, space_name, record, person)
+        if room_joins_after is not None:
+            for i, room in enumerate(rooms):
+                person = FakeParticipant(f"{record}/participants/room{i}", room.meet_user, room.display_name)
+                self.at(t0 + room_joins_after, self.join, space_name, record, person, room.room_email)
+                people.append(person)
+        for person in people:
+            self.at(t1, self.leave, space_name, person)
+        self.at(t1 + 1, self.meet.end_record, record)
+        self.at(t1 + 1, self.meet_event, space_name, "conference.v2.ended",
+                {'conferenceRecord': {'name': record}})
+        return space_name
+
+    def scripted(self, rooms, meetings_per_room=8, minutes=30, join_rate=0.8, shared_rate=0.1,
+                 tz='America/New_York', first_hour=9):
+        """
+        Book a day of meetings, meetings_per_room per room from first_hour on, in tz.
+        join_rate of the meetings are joined by the room within two minutes of starting;
+        shared_rate of them also book the next room.
+        """
+        zone = pytz.timezone(tz)
+        now = self.clock.now(zone)
+        day = zone.localize(datetime(now.year, now.month, now.day, first_hour))
+        booked = 0
+        for r, room in enumerate(rooms):
+            for m in range(meetings_per_room):
+                start = day + timedelta(minutes=m * (minutes + 30) + self.random.choice((0, 5, 10)))
+                guests = [room]
+                if len(rooms) > 1 and self.random.random() < shared_rate:
+                    guests.append(rooms[(r + 1) % len(rooms)])
+                joins = self.random.uniform(-60, 120) if self.random.random() < join_rate else None
+                self.book(guests, start, minutes, f"{room.name} meeting {m}",
+                          f"organizer{r % 7}@example.com", joins)
+                booked += 1
+        logger.info("Emulator: booked %d meetings in %d rooms", booked, len(rooms))
+        return booked
@@ -0,0 +1,191 @@
+"""
+Record the Pub/Sub traffic the notifier receives, and play it back.
+
+EventRecorder writes JSON lines, one record per line, each with its receive time "t":
+    {"type": "rooms", ...}          the rooms being watched (first line of every file)
+    {"type": "meetings", ...}       the meetings being watched, whenever they change
+    {"type": "participant", ...}    an identity the ParticipantResolver looked up
+    {"type": "message", ...}        a Pub/Sub message: id, publish_time, attributes, data
+so a recording holds everything needed to push the same messages through the callback
+again offline, including the answers the Meet API gave. Lines are buffered and written
+every flush_interval seconds or buffer_size bytes, from whichever thread gets there. Files
+are named <base>-<start time>-<n>.jsonl (or .jsonl.gz with compress=True). A new file starts
+when the current one reaches max_bytes, and only the newest `keep` files are kept.
+
+read_records() reads files back in order; ReplayMessage has the parts of a Pub/Sub
+message the callback uses. replay.py is the driver.
+"""
+
+import base64
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class EventRecorder:
+    def __init__(self, base, compress=False, max_bytes=64 << 20, keep=20,
+                 buffer_size=256 << 10, flush_interval=1.0):
+        self.base = base
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.buffered = 0
+        self.file = None
+        self.path = None
+        self.written = 0            # uncompressed bytes in the current file
+        self.rooms = []
+        self.last_meetings = None
+        self.last_flush = time.monotonic()
+        self.records = 0
+        self.stamp = time.strftime("%Y%m%d-%H%M%S")     # names sort by run, then by file
+        self.files = 0
+        os.makedirs(os.path.dirname(base) or ".", exist_ok=True)
+
+    def __repr__(self):
+        return f"<EventRecorder {self.path} {self.records} records>"
+
+    def _open(self):
+        """Start a new file. Call with the lock held."""
+        if self.file:
+            self.file.close()
+        self.files += 1
+        suffix = ".jsonl.gz" if self.compress else ".jsonl"
+        path = f"{self.base}-{self.stamp}-{self.files:04d}{suffix}"
+        self.path = path
+        self.file = gzip.open(path, "wb") if self.compress else open(path, "wb")
+        self.written = 0
+        for old in sorted(glob.glob(f"{self.base}-*.jsonl*"))[:-self.keep]:
+            os.remove(old)
+        logger.info("Recording events to %s", path)
+        # Each file starts with the current state, so it can be replayed on its own.
+        header = [self._line({'type': 'rooms', 'rooms': self.rooms})]
+        if self.last_meetings is not None:
+            header.append(self._line({'type': 'meetings', 'meetings': self.last_meetings}))
+        self._write(b"".join(header))
+
+    @staticmethod
+    def _line(record):
+        record.setdefault('t', time.time())
+        return (json.dumps(record, separators=(",", ":")) + "\n").encode()
+
+    def _write(self, data):
+        self.file.write(data)
+        self.written += len(data)
+
+    def _add(self, record):
+        line = self._line(record)
+        with self.lock:
+            self.buffer.append(line)
+            self.buffered += len(line)
+            self.records += 1
+            if self.buffered >= self.buffer_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        """Write out the buffer. Call with the lock held."""
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        if self.file is None or self.written >= self.max_bytes:
+            self._open()
+        self._write(b"".join(self.buffer))
+        self.file.flush()
+        self.buffer = []
+        self.buffered = 0
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def start(self):
+        """Flush in the background every flush_interval, so a quiet stream still reaches disk."""
+        def run():
+            while True:
+                time.sleep(self.flush_interval)
+                self.flush()
+        threading.Thread(target=run, name="event-recorder", daemon=True).start()
+        return self
+
+    def set_rooms(self, rooms):
+        self.rooms = [{'name': r.name, 'calendar_id': r.calendar_id, 'room_email': r.room_email,
+                       'meet_user': r.meet_user, 'display_name': r.display_name} for r in rooms]
+
+    def meetings(self, snapshot):
+        """Record the meetings being watched (space_id -> MeetingRecord) if they changed."""
+        meetings = [m.to_dict() for m in snapshot.values()]
+        if meetings == self.last_meetings:
+            return
+        self.last_meetings = meetings
+        self._add({'type': 'meetings', 'meetings': meetings})
+
+    def participant(self, identity):
+        self._add({'type': 'participant', 'name': identity.name, 'user': identity.user,
+                   'display_name': identity.display_name})
+
+    def message(self, message):
+        record = {'type': 'message',
+                  't': time.time(),
+                  'id': message.message_id,
+                  'publish_time': message.publish_time.isoformat() if message.publish_time else None,
+                  'attributes': dict(message.attributes)}
+        try:
+            record['data'] = message.data.decode()
+        except UnicodeDecodeError:
+            record['data_b64'] = base64.b64encode(message.data).decode()
+        self._add(record)
+
+
+class ReplayMessage:
+    """A recorded Pub/Sub message, for handing to the callback again."""
+    __slots__ = ('message_id', 'publish_time', 'attributes', 'data', 'acked')
+
+    def __init__(self, record):
+        self.message_id = record['id']
+        self.publish_time = datetime.fromisoformat(record['publish_time']) if record.get('publish_time') else None
+        self.attributes = record['attributes']
+        if 'data_b64' in record:
+            self.data = base64.b64decode(record['data_b64'])
+        else:
+            self.data = record['data'].encode()
+        self.acked = None
+
+    def ack(self):
+        self.acked = True
+
+    def nack(self):
+        self.acked = False
+
+
+def read_records(paths):
+    """Yield the records of the given recordings, oldest file first."""
+    for path in sorted(paths):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt") as f:
+            n = 0
+            try:
+                for n, line in enumerate(f, 1):
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line of a file that was still being written may be cut short.
+                        logger.warning("%s:%d: skipping a truncated record", path, n)
+            except EOFError:
+                logger.warning("%s: compressed stream ends after line %d", path, n)
@@ -0,0 +1,153 @@
+"""
+Join detection by polling the Meet ConferenceRecords API, for when the events don't say.
+
+Meet events can be lost, arrive late, or only name a participantSession, so the Pub/Sub
+callback alone may never see a room join. JoinPoller watches the same MeetingStore from the
+other side. For each meeting in its start window, from `early` seconds before the start to
+`window` seconds after, it:
+  - finds the space's active conference record (list_conference_records, filtered on
+    space.name and end_time IS NULL), once;
+  - lists the participants who arrived since its last poll (filtered on
+    earliest_start_time), so each poll only returns what's new;
+  - reports a participant who is one of the meeting's rooms to on_join(), the same path the
+    Pub/Sub callback takes, so the alert is cancelled by whichever detector sees it first.
+The participants it finds also go into the ParticipantResolver's cache.
+
+A meeting is polled every `fast` seconds for the first `fast_for` seconds after it starts,
+then every `slow` seconds, and only while one of its rooms hasn't joined: rooms the event
+stream has already confirmed are never asked about. Meetings outside their start window
+cost nothing.
+
+Configured by the optional "join_poller" section of notifier_config.json, e.g.
+    {"join_poller": {"window": 600, "fast": 10}}, or {"join_poller": false} to turn it off.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+
+import quota
+from participant_resolver import ParticipantIdentity
+
+logger = logging.getLogger(__name__)
+
+
+def rfc3339(when):
+    return when.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class Watch:
+    """What the poller knows about one meeting in its start window."""
+    __slots__ = ('record', 'since', 'seen', 'next_poll')
+
+    def __init__(self):
+        self.record = None          # conferenceRecords/... once the conference has started
+        self.since = None           # latest earliest_start_time seen
+        self.seen = set()           # participant names already looked at
+        self.next_poll = 0
+
+
+class JoinPoller:
+    def __init__(self, meetings, client_for, on_join, resolver=None, early=120, window=900,
+                 fast=5, slow=30, fast_for=300, workers=4, clock=time):
+        """
+        :param client_for: client_for(subject) returns a ConferenceRecordsServiceClient.
+        :param on_join: on_join(meeting, room) when a room is seen in its meeting.
+        """
+        self.meetings = meetings
+        self.client_for = client_for
+        self.on_join = on_join
+        self.resolver = resolver
+        self.early = early
+        self.window = window
+        self.fast = fast
+        self.slow = slow
+        self.fast_for = fast_for
+        self.clock = clock
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="join-poller")
+        self.watches = {}           # space_id -> Watch
+        self.polls = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __repr__(self):
+        return f"<JoinPoller {len(self.watches)} meetings, {self.polls} polls>"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="join-poller", daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error("Join poll failed: %s", e)
+            self.clock.sleep(self.fast)
+
+    def stop(self):
+        self.stopped.set()
+
+    def tick(self):
+        """Poll the meetings that are due. Returns how many were."""
+        now = self.clock.time()
+        snapshot = self.meetings.snapshot()
+        watches = {}
+        due = []
+        for space_id in self.meetings.live(now + self.early):
+            meeting = snapshot.get(space_id)
+            if meeting is None or now > meeting.start_ts + self.window or not meeting.unjoined_rooms():
+                continue
+            watch = watches[space_id] = self.watches.get(space_id) or Watch()
+            if watch.next_poll <= now:
+                watch.next_poll = now + (self.fast if now < meeting.start_ts + self.fast_for else self.slow)
+                due.append((meeting, watch))
+        self.watches = watches
+        list(self.executor.map(self._poll, due))
+        return len(due)
+
+    def _poll(self, due):
+        meeting, watch = due
+        try:
+            self.poll(meeting, watch)
+        except Exception as e:
+            logger.warning("Could not poll the participants of %s: %s", meeting.space_id, e)
+
+    def poll(self, meeting, watch):
+        client = self.client_for(meeting.organizer)
+        self.polls += 1
+        if watch.record is None:
+            request = {"filter": f'space.name = "{meeting.space_id}" AND end_time IS NULL'}
+            records = quota.call("meet.list_conference_records",
+                                 lambda: list(client.list_conference_records(request=request)))
+            if not records:
+                return
+            watch.record = records[0].name
+            logger.debug("%s is live as %s", meeting.space_id, watch.record)
+
+        request = {"parent": watch.record}
+        if watch.since:
+            request["filter"] = f'earliest_start_time >= "{rfc3339(watch.since)}"'
+        identities = []
+        for p in quota.call("meet.list_participants", lambda: list(client.list_participants(request=request))):
+            if p.name in watch.seen:
+                continue
+            watch.seen.add(p.name)
+            identities.append(ParticipantIdentity.from_participant(p))
+            started = getattr(p, 'earliest_start_time', None)
+            if started and (watch.since is None or started > watch.since):
+                watch.since = started
+        if not identities:
+            return
+        if self.resolver:
+            self.resolver.remember(watch.record, identities)
+
+        # The event stream may have seen some of the rooms join while we were asking.
+        current = self.meetings.get(meeting.space_id) or meeting
+        for identity in identities:
+            for email, room in current.rooms.items():
+                if email not in current.joined and room.matches(identity):
+                    self.on_join(current, room)
@@ -23,27 +23,40 @@ https://developers.google.com/workspace/events/guides/events-meet
 
 
 
+import atexit
 import json
 import os
-import sys
-import datetime
+import re
 import time
 import logging
-import subprocess
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-from googleapiclient.discovery import build
-from datetime import datetime, timedelta, timezone
+from datetime import datetime
 import pytz
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.oauth2 import service_account
-from google.cloud import pubsub_v1
-from google.apps import meet_v2
-from googleapiclient.errors import HttpError
-from google.api_core.exceptions import AlreadyExists
-from google.iam.v1 import policy_pb2
+
+# The Google client libraries take seconds to import, so they are imported where they are
+# first used: the OAuth flow only in OAuth mode, Pub/Sub only by the threads that set it up.
+
+from startup_profile import StartupProfile
+from calendar_sync import CalendarSync
+from credential_pool import CredentialPool
+from rooms import load_rooms
+from space_cache import SpaceCache
+from scheduler import AlertScheduler, refresh_interval
+from timeline import epoch
+from alert_player import AlertEngine
+from participant_resolver import ParticipantResolver
+from dedup import DedupWindow
+from meeting_state import MeetingRecord, MeetingStore
+from subscription_reconciler import SubscriptionReconciler, delete_orphaned_pubsub_subscriptions
+from state_db import StateDB, DEFAULT_PATH as STATE_DB_FILE
+from event_log import EventRecorder
+from pubsub_listener import start_listener
+from poll_cycle import PollCycle
+from join_poller import JoinPoller
+from sharding import LeaseStore, ShardCoordinator
+import metrics
+import quota
 
 # Constants
 TOPIC_ID = "meet-events"
@@ -52,11 +65,30 @@ ROOM_EMAIL = "c_188fmt6m2v6sahkjhd0kvdtkh12q6@resource.calendar.google.com"
 FILTER_EMAIL = 'simsong@basistech.comx'
 MP3_FILE = "alert.mp3"
 RETENTION_SECONDS = 60
+LOOKAHEAD_HOURS = 24        # how far ahead each room's calendar is kept
+PREWARM_MINUTES = 120       # resolve spaces and subscribe this long before a meeting starts
+ORPHAN_SWEEP_SECONDS = 86400
+ORPHAN_RETRY_SECONDS = 600  # after a failed sweep
+CALL_TIMEOUT_SECONDS = 10   # per Meet call
+CYCLE_DEADLINE_SECONDS = 30 # for one pass of the main loop
+# Event types the callback acts on; everything else is acked without decoding the payload.
+HANDLED_EVENT_TYPES = (
+    "google.workspace.meet.participant.v2.joined",
+    "google.workspace.meet.conference.v2.started",
+    "google.workspace.meet.conference.v2.ended",
+)
+CONFERENCE_ENDED = HANDLED_EVENT_TYPES[2]
 
 # Logging
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# time.time()/time.sleep() for the main loop and calendar windows; --emulate swaps in a
+# VirtualClock that can run faster than real time.
+clock = time
+# (space_id, room_email) pairs that have alerted at least once, for meeting_alert_delay_seconds.
+alerted = set()
+
 # Credentials and config
 SCOPES = [
     'https://www.googleapis.com/auth/calendar.readonly',
@@ -69,10 +101,10 @@ SA_FILE = 'service_account.json'
 OAUTH2_TOKEN_FILENAME = 'meeting_notifier_continuous_token.json'
 OAUTH2_CREDENTIALS_FILENAME = 'client_secrets.json'
 
-def get_meet_creds(use_sa=False, organizer=None):
-    if use_sa:
-        creds = service_account.Credentials.from_service_account_file(SA_FILE, scopes=SCOPES)
-        return creds.with_subject(organizer) if organizer else creds
+def get_meet_creds():
+    """OAuth2 user credentials. Called once, by the CredentialPool, when not using --sa_creds."""
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
     if os.path.exists(OAUTH2_TOKEN_FILENAME):
         return Credentials.from_authorized_user_file(OAUTH2_TOKEN_FILENAME, SCOPES)
     flow = InstalledAppFlow.from_client_secrets_file(OAUTH2_CREDENTIALS_FILENAME, SCOPES)
@@ -84,6 +116,9 @@ def get_meet_creds(use_sa=False, organizer=None):
 class Event:
     def __init__(self, event):
         self.event = event
+        # Parsed once, into epoch seconds, whatever offset the calendar wrote them in.
+        self.start_ts = epoch(self.start)
+        self.end_ts = epoch(self.end)
     def __repr__(self):
         return f"<Event {self.start} to {self.end} - {self.summary}>"
     @property
@@ -91,16 +126,18 @@ class Event:
         return self.event.get('conferenceData', {}).get('conferenceId')
     @property
     def start(self):
-        return self.event['start'].get('dateTime')
+        return self.event['start'].get('dateTime') or self.event['start'].get('date')
     @property
     def end(self):
-        return self.event['end'].get('dateTime')
+        return self.event['end'].get('dateTime') or self.event['end'].get('date')
     @property
     def ended(self):
-        event_end = datetime.fromisoformat(self.end)
-        if event_end.tzinfo is None:
-            event_end = event_end.replace(tzinfo=timezone.utc)
-        return event_end <= datetime.now(timezone.utc)
+        return self.end_ts <= clock.time()
+    @property
+    def conference_version(self):
+        # Unlike the event's etag, the signature is the same in every attendee's copy of it,
+        # so a meeting booked in several rooms resolves its space once.
+        return self.event.get('conferenceData', {}).get('signature')
     @property
     def summary(self):
         return self.event.get('summary', '(No Title)')
@@ -108,159 +145,489 @@ class Event:
     def organizer_email(self):
         return self.event.get('creator', {}).get('email')
 
-def get_todays_meetings(creds, calendarId):
-    tz = pytz.timezone('America/New_York')
-    now = datetime.now(tz)
-    time_min = tz.localize(datetime(now.year, now.month, now.day)).isoformat()
-    time_max = (tz.localize(datetime(now.year, now.month, now.day)) + timedelta(days=1)).isoformat()
-
-    calendar_service = build("calendar", "v3", credentials=creds)
-    events_result = calendar_service.events().list(
-        calendarId=calendarId,
-        timeMin=time_min,
-        timeMax=time_max,
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
-    return [Event(e) for e in events_result.get('items', [])]
-
-def ensure_topic_and_permissions():
-    sa_creds = service_account.Credentials.from_service_account_file(SA_FILE)
-    publisher = pubsub_v1.PublisherClient(credentials=sa_creds)
-    topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
+def calendar_window(room, now, lookahead):
+    """
+    The part of the room's calendar to keep: from midnight in the room's timezone to
+    `lookahead` seconds ahead, rounded up to the hour so the window only grows once an hour.
+    """
+    tz = pytz.timezone(room.timezone)
+    local = datetime.fromtimestamp(now, tz)
+    midnight = tz.localize(datetime(local.year, local.month, local.day))
+    end = (int(now + lookahead) // 3600 + 1) * 3600
+    return midnight.isoformat(), datetime.fromtimestamp(end, tz).isoformat()
+
+def get_upcoming_meetings(room, lookahead=LOOKAHEAD_HOURS * 3600):
+    time_min, time_max = calendar_window(room, clock.time(), lookahead)
+    return [Event(e) for e in room.sync.refresh(time_min, time_max)]
+
+def ensure_topic_and_permissions(pool, state, topic_path=f"projects/{PROJECT_ID}/topics/{TOPIC_ID}"):
+    recorded = state.resource("topic")
+    if recorded == {"name": topic_path, "state": "active"}:
+        logger.info(f"Using recorded topic: {topic_path}")
+        return topic_path
+
+    state.begin_resource("topic", topic_path)
+    publisher = pool.publisher()
 
     try:
-        publisher.get_topic(request={"topic": topic_path})
+        quota.call("pubsub.get_topic", lambda: publisher.get_topic(request={"topic": topic_path}))
         logger.info(f"Using existing topic: {topic_path}")
     except Exception:
-        publisher.create_topic(request={"name": topic_path})
+        quota.call("pubsub.create_topic", lambda: publisher.create_topic(request={"name": topic_path}))
         logger.info(f"Created topic: {topic_path}")
 
-    policy = publisher.get_iam_policy(request={"resource": topic_path})
+    policy = quota.call("pubsub.get_iam_policy", lambda: publisher.get_iam_policy(request={"resource": topic_path}))
     role = "roles/pubsub.publisher"
     member = "serviceAccount:meet-api-event-push@system.gserviceaccount.com"
 
     already_bound = any(b.role == role and member in b.members for b in policy.bindings)
 
     if not already_bound:
+        from google.iam.v1 import policy_pb2
         policy.bindings.append(policy_pb2.Binding(role=role, members=[member]))
-        publisher.set_iam_policy(request={"resource": topic_path, "policy": policy})
+        quota.call("pubsub.set_iam_policy",
+                   lambda: publisher.set_iam_policy(request={"resource": topic_path, "policy": policy}))
         logger.info("Granted meet-api-event-push permission on topic")
 
+    state.commit_resource("topic", topic_path)
     return topic_path
 
-def start_pubsub_listener(subscription_path, meetings):
-    sa_creds = service_account.Credentials.from_service_account_file(SA_FILE)
-    subscriber = pubsub_v1.SubscriberClient(credentials=sa_creds)
+def ensure_subscription(pool, state, topic_path, subscription_path):
+    """A sharded worker's own Pub/Sub subscription on its own topic. (The single-process one is made by hand.)"""
+    if state.resource("subscription") == {"name": subscription_path, "state": "active"}:
+        return subscription_path
+    state.begin_resource("subscription", subscription_path)
+    subscriber = pool.subscriber()
+    try:
+        quota.call("pubsub.get_subscription",
+                   lambda: subscriber.get_subscription(request={"subscription": subscription_path}))
+    except Exception:
+        quota.call("pubsub.create_subscription",
+                   lambda: subscriber.create_subscription(request={"name": subscription_path, "topic": topic_path}))
+        logger.info(f"Created subscription: {subscription_path}")
+    state.commit_resource("subscription", subscription_path)
+    return subscription_path
+
+def subject_space_id(subject):
+    """//meet.googleapis.com/spaces/abc -> spaces/abc"""
+    return subject.split("meet.googleapis.com/", 1)[-1]
+
+def event_space_id(message, data):
+    """The meeting space an event is about: from the payload, else from the CloudEvents subject."""
+    if "space" in data:
+        return data["space"]
+    return subject_space_id(message.attributes.get("ce-subject", ""))
+
+def joined_room(meeting, data, resolver):
+    """The meeting's room that a participant event is about, or None."""
+    rooms = meeting.rooms
+    email = data.get("participant", {}).get("emailAddress", "")
+    if email:
+        return rooms.get(email.lower())
+    session = data.get("participantSession", {}).get("name")
+    if not session or not rooms:
+        return None
+    identity = resolver.resolve(session, meeting.organizer)
+    logger.debug("%s is %s", session, identity)
+    for room in rooms.values():
+        if room.matches(identity):
+            return room
+    return None
+
+def record_join(meetings, scheduler, meeting, room, detector="events"):
+    """A room was seen in its meeting, by the Pub/Sub callback or the JoinPoller."""
+    if not meetings.mark_joined(meeting.space_id, room.room_email):
+        return
+    logger.info(f"✅ Room {room.name} joined meeting: {meeting.space_id}" + (" (polled)" if detector == "poll" else ""))
+    scheduler.cancel((meeting.space_id, room.room_email))
+    metrics.JOINS.inc(detector=detector)
+    metrics.JOIN_DELAY.observe(max(0, clock.time() - meeting.start_ts))
+
+def make_callback(meetings, scheduler, resolver, recorder=None):
+    """The Pub/Sub message handler. replay.py drives the same one from a recording."""
+    dedup = DedupWindow()
 
     def callback(message):
+        started = time.perf_counter()
+        if recorder:
+            recorder.message(message)
+        if message.publish_time:
+            metrics.DELIVERY_LAG.observe(clock.time() - message.publish_time.timestamp())
+        outcome = handle(message)
+        metrics.MESSAGES.inc(outcome=outcome)
+        metrics.CALLBACK_SECONDS.observe(time.perf_counter() - started)
+
+    def handle(message):
+        """Process one message. Returns what happened to it, for pubsub_messages_total."""
+        attributes = message.attributes
+        ids = (attributes.get("ce-id"), message.message_id)
         try:
-            data = json.loads(message.data.decode("utf-8"))
-            logger.info(f"Received event: {json.dumps(data, indent=2)}")
-            space_id = data.get("space", "")
-            participant = data.get("participant", {})
-            participant_email = participant.get("emailAddress", "")
-            event_type = data.get("eventType", "")
-
-            if (event_type.endswith("joined") and space_id in meetings and participant_email.lower() == ROOM_EMAIL.lower()):
-                logger.info(f"✅ Room joined meeting: {space_id}")
-                meetings[space_id]["joined"] = True
+            # Fast path: decide from the attributes alone whether the event matters.
+            event_type = attributes.get("ce-type")
+            if event_type and event_type not in HANDLED_EVENT_TYPES:
+                message.ack()
+                return "ignored"
+            subject = attributes.get("ce-subject")
+            # A conference usually ends after its meeting has left the store; its ended event
+            # still has to reach resolver.forget(), or the record's cache is never released.
+            if (subject and event_type != CONFERENCE_ENDED
+                    and subject_space_id(subject) not in meetings):
+                message.ack()
+                return "ignored"
+            if dedup.seen(*ids):
+                logger.debug("Duplicate delivery: %s", ids)
+                message.ack()
+                return "duplicate"
+
+            data = json.loads(message.data)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Received event: {json.dumps(data, indent=2)}")
+            space_id = event_space_id(message, data)
+            meeting = meetings.get(space_id)
+            event_type = event_type or data.get("eventType", "")
+            logger.info("Received %s for %s", event_type, space_id)
+
+            record = data.get("conferenceRecord", {}).get("name")
+
+            if event_type.endswith("conference.v2.started") and meeting and record:
+                resolver.prefetch(record, meeting.organizer)
+            elif event_type.endswith("conference.v2.ended") and record:
+                resolver.forget(record)
+            elif event_type.endswith("joined") and meeting:
+                room = joined_room(meeting, data, resolver)
+                if room:
+                    record_join(meetings, scheduler, meeting, room)
 
             message.ack()
+            return "ack"
         except Exception as e:
             logger.error(f"PubSub message handling error: {e}")
+            dedup.forget(*ids)
             message.nack()
-
-    subscriber.subscribe(subscription_path, callback=callback)
-    logger.info(f"Subscribing to Pub/Sub on {subscription_path}")
-
-def subscribe_to_meeting_space(meet_creds, space_id, topic_path):
-    workspace_service = build('workspaceevents', 'v1', credentials=meet_creds)
-    body = {
-        "targetResource": f"//meet.googleapis.com/{space_id}",
-        "eventTypes": [
-            "google.workspace.meet.participant.v2.joined",
-            "google.workspace.meet.participant.v2.left",
-            "google.workspace.meet.conference.v2.started",
-            "google.workspace.meet.conference.v2.ended",
-        ],
-        "payloadOptions": {
-            "includeResource": True,
-        },
-        "notificationEndpoint": {
-            "pubsub_topic": topic_path
-        },
-        "ttl" : "86400s",
-    }
+            return "nack"
+
+    return callback
+
+def start_pubsub_listener(subscription_path, meetings, pool, scheduler, resolver, recorder=None, settings=None):
+    """One subscription for every room. Each event is routed to its meeting by space id."""
+    callback = make_callback(meetings, scheduler, resolver, recorder)
+    listener = start_listener(pool.subscriber(), subscription_path, callback, settings, clock=clock)
+    logger.info(f"Receiving Pub/Sub messages on {subscription_path} with {listener}")
+    return listener
+
+def alert_due(meetings, alerts, key):
+    """AlertScheduler callback. Queues the alert if the room still hasn't joined; never blocks."""
+    space_id, room_email = key
+    meeting = meetings.get(space_id)
+    room = meeting.rooms.get(room_email) if meeting else None
+    if room is None or room_email in meeting.joined:
+        return False
+    if key not in alerted:
+        alerted.add(key)
+        metrics.ALERT_DELAY.observe(max(0, clock.time() - meeting.start_ts))
+    metrics.ALERTS.inc(room=room.name)
+    alerts.alert(room)
+    return True
+
+def schedule_alerts(scheduler, meetings):
+    """Bring the scheduler in line with meetings. Returns their Timeline."""
+    wanted = set()
+    for sid, meeting in meetings.snapshot().items():
+        for room in meeting.unjoined_rooms():
+            wanted.add((sid, room.room_email))
+            scheduler.schedule((sid, room.room_email), meeting.start_ts, meeting.end_ts)
+    for key in set(scheduler.keys()) - wanted:
+        scheduler.cancel(key)
+    alerted.intersection_update(wanted)
+    return meetings.timeline
+
+def resolve_space(e, pool, timeout=CALL_TIMEOUT_SECONDS):
+    """Ask Meet for the space behind a calendar event. Only called on a SpaceCache miss."""
+    meet_client = pool.spaces_client(e.organizer_email)
+    return quota.call("meet.get_space",
+                      lambda: meet_client.get_space(name=f"spaces/{e.conferenceId}", timeout=timeout).name,
+                      key=("get_space", e.conferenceId))
+
+def watchable(e, horizon):
+    """Whether the main loop should watch a calendar event now: it has a Meet link, hasn't ended and starts before horizon."""
+    if not e.conferenceId:
+        logger.debug("EVENT: %s no conferenceId", e)
+        return False
+    if e.ended:
+        logger.debug("EVENT: %s has already ended", e)
+        return False
+    # Watched (space resolved, subscribed) once it is PREWARM_MINUTES away.
+    return e.start_ts <= horizon
+
+def sweep_orphans(pool, state):
+    """
+    Delete Pub/Sub subscriptions left on deleted topics, at most once every ORPHAN_SWEEP_SECONDS.
+    Best-effort: a failed sweep is logged and tried again ORPHAN_RETRY_SECONDS later.
+    """
+    from google.api_core.exceptions import GoogleAPICallError
+    now = time.time()
+    if (now - state.get("orphan_sweep", 0) < ORPHAN_SWEEP_SECONDS
+            or now - state.get("orphan_sweep_failed", 0) < ORPHAN_RETRY_SECONDS):
+        return
     try:
-        sub = workspace_service.subscriptions().create(body=body).execute()
-        logger.info(f"Created subscription: {sub['name']}")
-        return sub['name']
-    except Exception as e:
-        logger.warning(f"Error creating subscription for {space_id}: {e}")
-        return None
-
-def play_alert():
-    logger.warning("\u26a0\ufe0f Conference room has not joined a live meeting!")
-    subprocess.call(["afplay", MP3_FILE])
+        delete_orphaned_pubsub_subscriptions(pool.subscriber(), PROJECT_ID, prefix=TOPIC_ID)
+    except GoogleAPICallError as e:
+        logger.warning("Could not sweep orphaned Pub/Sub subscriptions: %s", e)
+        state.put("orphan_sweep_failed", now)
+        return
+    state.put("orphan_sweep", now)
+
+def warm_calendar(room, pool, lookahead=LOOKAHEAD_HOURS * 3600):
+    """Give the room the calendar service and refresh it (a seed or delta the first time). Returns its events."""
+    room.sync.calendar_service = pool.calendar_service()
+    return get_upcoming_meetings(room, lookahead)
+
+def nap(seconds, wake=None):
+    """clock.sleep(seconds), cut short once the threading.Event `wake` is set."""
+    if wake is None:
+        clock.sleep(seconds)
+        return
+    end = clock.time() + seconds
+    while not wake.is_set() and clock.time() < end:
+        clock.sleep(min(1, end - clock.time()))
+
+def restore_state(state, rooms, meetings, space_cache, reconciler):
+    """Load what the last run saved. Returns True if there was anything to load."""
+    for room in rooms:
+        saved = state.get(f"calendar:{room.calendar_id}")
+        if saved:
+            room.sync.restore(saved)
+    spaces = state.get("spaces")
+    if spaces:
+        space_cache.load(spaces["entries"], age=time.time() - spaces["saved_at"])
+    saved_meetings = state.get("meetings")
+    if saved_meetings:
+        rooms_by_email = {room.room_email: room for room in rooms}
+        meetings.replace({m['space_id']: MeetingRecord.from_dict(m, rooms_by_email) for m in saved_meetings})
+    subscriptions = state.get("subscriptions")
+    if subscriptions:
+        reconciler.restore(subscriptions)
+    return bool(saved_meetings or spaces)
+
+def save_state(state, rooms, meetings, space_cache, reconciler):
+    values = {"meetings": [m.to_dict() for m in meetings.snapshot().values()],
+              "spaces": {"saved_at": time.time(), "entries": space_cache.dump()},
+              "subscriptions": reconciler.state()}
+    for room in rooms:
+        if room.sync.changed:
+            values[f"calendar:{room.calendar_id}"] = room.sync.state()
+    state.put_many(values)
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--sa_creds", action="store_true")
+    parser.add_argument("--state_db", help=f"local state for warm restarts (default: {STATE_DB_FILE})")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="log how long each import and bootstrap phase took")
+    parser.add_argument("--emulate", type=int, metavar="ROOMS",
+                        help="run against in-process fake Google APIs with this many scripted rooms")
+    parser.add_argument("--speed", type=float, default=1.0, help="with --emulate, virtual seconds per real second")
+    parser.add_argument("--seed", type=int, default=0, help="with --emulate, random seed for the script")
+    parser.add_argument("--event-loss", type=float, default=0.0,
+                        help="with --emulate, fraction of Meet events that are never delivered")
+    parser.add_argument("--record", metavar="BASE",
+                        help="record received events to BASE-<timestamp>.jsonl for replay.py")
+    parser.add_argument("--record-gzip", action="store_true", help="compress the recording")
+    parser.add_argument("--record-max-mb", type=int, default=64, help="start a new recording file at this size")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-address", default="127.0.0.1",
+                        help="with --metrics-port, the address to listen on (0.0.0.0 for all)")
+    parser.add_argument("--pull", action="store_true",
+                        help="receive events with batched synchronous pull instead of a streaming pull")
+    parser.add_argument("--push-port", type=int,
+                        help="receive events as Pub/Sub pushes to http://host:PORT/push instead of pulling "
+                             "(only on 127.0.0.1 unless the pubsub config sets a token or audience)")
+    parser.add_argument("--shard-db", metavar="PATH",
+                        help="share the rooms with the other workers that lease from this SQLite file")
+    parser.add_argument("--worker-id", help="with --shard-db, this worker's name, unique among the workers")
     args = parser.parse_args()
     if args.debug:
         logger.setLevel(logging.DEBUG)
-
-    with open("notifier_config.json") as f:
-        config = json.load(f)
-
-    topic_path = ensure_topic_and_permissions()
-    subscription_path = f"projects/{PROJECT_ID}/subscriptions/{TOPIC_ID}-sub"
-    meetings = defaultdict(dict)
-    start_pubsub_listener(subscription_path, meetings)
-
-    calendar_creds = service_account.Credentials.from_service_account_file(SA_FILE, scopes=SCOPES)
+    profile = StartupProfile(args.startup_profile)
+
+    with profile.phase("config + local state"):
+        if args.emulate:
+            from emulator import Emulator, VirtualClock, morning
+            from rooms import Room
+            config = {}
+            rooms = [Room(f"Room {i}", f"room{i}@resource.calendar.google.com", alert_sink="null")
+                     for i in range(args.emulate)]
+            quota.unlimited()
+        else:
+            with open("notifier_config.json") as f:
+                config = json.load(f)
+            rooms = load_rooms(config, ROOM_EMAIL)
+            quota.configure(config.get('quota', {}))
+        # A sharded worker has a topic, Pub/Sub subscription and local state of its own, so
+        # it only receives the events of the meetings it subscribed to (see sharding.py).
+        sharding = dict(config.get('sharding', {}))
+        shard_db = args.shard_db or sharding.pop('db', None)
+        worker = None
+        topic_id = TOPIC_ID
+        if shard_db:
+            # The name keys the worker's lease, topic and state file, so it has to be given:
+            # the host name would be shared by two workers on one host, and the pid changes
+            # on every restart, leaving the old topic and state behind.
+            if not args.worker_id:
+                parser.error("--worker-id is required with --shard-db")
+            worker = re.sub(r"[^A-Za-z0-9-]", "-", args.worker_id)
+            topic_id = f"{TOPIC_ID}-{worker}"
+        topic_path = f"projects/{PROJECT_ID}/topics/{topic_id}"
+        subscription_path = f"projects/{PROJECT_ID}/subscriptions/{topic_id}-sub"
+        if args.emulate:
+            state = StateDB(args.state_db or ":memory:")
+        else:
+            state = StateDB(args.state_db or (f"notifier_state-{worker}.db" if worker else STATE_DB_FILE))
+        logger.info("Monitoring %d room(s)", len(rooms))
+
+    with profile.phase("credentials"):
+        if args.emulate:
+            pool = Emulator(VirtualClock(morning(), speed=args.speed), seed=args.seed, event_loss=args.event_loss,
+                            use_sa=args.sa_creds)
+            clock = pool.clock
+            pool.pubsub.create_topic(name=topic_path)
+            push_config = {'push_endpoint': f"http://127.0.0.1:{args.push_port}/push"} if args.push_port else None
+            pool.pubsub.create_subscription(name=subscription_path, topic=topic_path, push_config=push_config)
+            pool.scripted(rooms)
+            pool.start()
+        else:
+            pool = CredentialPool(SA_FILE, SCOPES, use_sa=args.sa_creds, oauth_loader=get_meet_creds).start()
+            if worker:
+                # The listener needs the worker's subscription, so it can't wait for the bootstrap.
+                ensure_topic_and_permissions(pool, state, topic_path)
+                ensure_subscription(pool, state, topic_path, subscription_path)
+
+    owned = rooms
+    shard = None
+    if shard_db:
+        with profile.phase("shard lease"):
+            shard = ShardCoordinator(LeaseStore(shard_db), worker, **sharding).start()
+            atexit.register(shard.stop)
+            owned = shard.mine(rooms)
+        logger.info("Worker %s watches %d of %d room(s)", worker, len(owned), len(rooms))
+    meetings = MeetingStore()
+    lookahead = config.get('lookahead_hours', LOOKAHEAD_HOURS) * 3600
+    prewarm = config.get('prewarm_minutes', PREWARM_MINUTES) * 60
+    with profile.phase("alert sound"):
+        alerts = AlertEngine(MP3_FILE).preload(room.alert_sink for room in rooms)
+    scheduler = AlertScheduler(lambda key: alert_due(meetings, alerts, key),
+                               grace=config.get('grace_seconds', 0), clock=clock.time,
+                               wait=clock.wait if args.emulate else None).start()
+    resolver = ParticipantResolver(pool.conference_records_client)
+    pubsub_settings = dict(config.get('pubsub', {}))
+    if args.pull:
+        pubsub_settings['mode'] = 'pull'
+    elif args.push_port:
+        pubsub_settings.update(mode='push', port=args.push_port)
+    recorder = None
+    if args.record:
+        recorder = EventRecorder(args.record, compress=args.record_gzip,
+                                 max_bytes=args.record_max_mb << 20).start()
+        recorder.set_rooms(rooms)
+        resolver.on_resolved = recorder.participant
+    join_poller = None
+    if config.get('join_poller', {}) is not False:
+        join_poller = JoinPoller(meetings, pool.conference_records_client,
+                                 lambda meeting, room: record_join(meetings, scheduler, meeting, room, "poll"),
+                                 resolver, clock=clock, **config.get('join_poller', {}))
+    space_cache = SpaceCache()
+    call_timeout = config.get('call_timeout', CALL_TIMEOUT_SECONDS)
+    cycle_deadline = config.get('cycle_deadline', CYCLE_DEADLINE_SECONDS)
+    # Orphans are left to the single process: every worker sweeping them would race.
+    reconciler = SubscriptionReconciler(pool, topic_path, orphans=not worker,
+                                        executor=ThreadPoolExecutor(max_workers=4, thread_name_prefix="subscriptions"))
+    for room in rooms:
+        room.sync = CalendarSync(None, room.calendar_id)
+
+    with profile.phase("restore state"):
+        if restore_state(state, rooms, meetings, space_cache, reconciler):
+            logger.info("Restored %d meeting(s) from %s", len(meetings), state.path)
+            schedule_alerts(scheduler, meetings)
+        if recorder:
+            recorder.meetings(meetings.snapshot())
+
+    # Topic setup, the Pub/Sub stream and the first calendar fetches don't depend on each
+    # other, so they run side by side. The topic has to exist before the reconciler creates
+    # subscriptions that point at it, which only happens in the main loop.
+    with profile.phase("parallel bootstrap"), ThreadPoolExecutor(thread_name_prefix="bootstrap") as bootstrap:
+        steps = [bootstrap.submit(profile.timed("topic and IAM", ensure_topic_and_permissions),
+                                  pool, state, topic_path),
+                 bootstrap.submit(profile.timed("pubsub listener", start_pubsub_listener),
+                                  subscription_path, meetings, pool, scheduler, resolver, recorder,
+                                  pubsub_settings),
+                 bootstrap.submit(profile.timed("orphan sweep", sweep_orphans), pool, state)]
+        steps += [bootstrap.submit(profile.timed(f"calendar {room.name}", warm_calendar), room, pool, lookahead)
+                  for room in owned]
+        for step in steps:
+            step.result()
+    profile.report()
+    if join_poller:
+        join_poller.start()
+
+    calendar_pool = ThreadPoolExecutor(max_workers=min(len(rooms), 16), thread_name_prefix="calendar")
+    meet_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="meet")
+    # warm_calendar, not get_upcoming_meetings: rooms taken over from another worker start cold.
+    cycle = PollCycle(lambda room: warm_calendar(room, pool, lookahead),
+                      lambda e: space_cache.get(e.conferenceId, e.conference_version,
+                                                lambda: resolve_space(e, pool, call_timeout)),
+                      calendar_pool, meet_pool, deadline=cycle_deadline)
+
+    if args.metrics_port:
+        metrics.Gauge("meetings_watched", "Meetings not yet ended.", lambda: len(meetings))
+        metrics.Gauge("meetings_live", "Meetings under way.", lambda: len(meetings.live(clock.time())))
+        metrics.Gauge("alerts_scheduled", "Room/meeting pairs with a pending alert.", lambda: len(scheduler.keys()))
+        metrics.Gauge("space_cache_entries", "Resolved meeting spaces cached.", lambda: len(space_cache))
+        metrics.Gauge("rooms_watched", "Rooms this worker watches.", lambda: len(owned))
+        metrics.serve(args.metrics_port, args.metrics_address)
 
     while True:
         logger.info("loop again")
-        events = get_todays_meetings(calendar_creds, config['monitor_calendar_id'])
-        now = datetime.utcnow().isoformat() + "Z"
-        active = []
-
-        for e in events:
-            if not e.conferenceId:
-                logger.debug("EVENT: %s no conferenceId", e)
-                continue
-            if e.ended:
-                logger.debug("EVENT: %s has already ended", e)
-                continue
-            meet_creds = get_meet_creds(args.sa_creds, e.organizer_email if args.sa_creds else None)
-            meet_client = meet_v2.SpacesServiceClient(credentials=meet_creds)
-            try:
-                space = meet_client.get_space(name=f"spaces/{e.conferenceId}")
-                space_id = space.name
-                logger.debug("EVENT: %s space_id: %s", e, space_id)
-                meetings[space_id].update({
-                    'start': e.start,
-                    'end': e.end,
-                    'joined': False,
-                    'summary': e.summary
-                })
-                if 'subscription' not in meetings[space_id]:
-                    meetings[space_id]['subscription'] = subscribe_to_meeting_space(meet_creds, space_id, topic_path)
-                active.append(space_id)
-            except Exception as err:
-                logger.error(f"Error retrieving space for {e.conferenceId}: {err}")
-
-        inactive = set(meetings.keys()) - set(active)
-        for sid in inactive:
+        loop_started = time.perf_counter()
+        active = {}             # space_id -> MeetingRecord
+        if shard:
+            shard.changed.clear()
+            if shard.mine(rooms) != owned:
+                owned = shard.mine(rooms)
+                logger.info("Rebalanced: worker %s now watches %d of %d room(s)", worker, len(owned), len(rooms))
+
+        horizon = clock.time() + prewarm
+        # Calendar refreshes and space lookups run side by side; see poll_cycle.py.
+        for room, e, space_id in cycle.run(owned, lambda e: watchable(e, horizon)):
+            logger.debug("EVENT: %s %s space_id: %s", room, e, space_id)
+            if space_id not in active:
+                active[space_id] = MeetingRecord(space_id, e.start, e.end, e.summary, e.organizer_email,
+                                                 start_ts=e.start_ts, end_ts=e.end_ts)
+            active[space_id].rooms[room.room_email] = room
+
+        # Subscriptions get what is left of the deadline, but at least one call's worth.
+        subscriptions = reconciler.reconcile(active, deadline=max(cycle.remaining(), call_timeout))
+        for sid, meeting in active.items():
+            meeting.subscription = subscriptions.get(sid)
+
+        for sid in set(meetings.snapshot()) - set(active):
             logger.debug(f"Removing expired meeting: {sid}")
-            meetings.pop(sid)
-
-        for sid, meta in meetings.items():
-            if meta['start'] < now < meta['end'] and not meta['joined']:
-                play_alert()
-
-        time.sleep(5)
+        meetings.replace(active)
+        if recorder:
+            recorder.meetings(meetings.snapshot())
+
+        logger.debug("Space cache: %s", space_cache.stats())
+        save_state(state, rooms, meetings, space_cache, reconciler)
+        sweep_orphans(pool, state)
+
+        timeline = schedule_alerts(scheduler, meetings)
+        metrics.LOOP_SECONDS.observe(time.perf_counter() - loop_started)
+        delay = refresh_interval(clock.time(), timeline)
+        # Under quota pressure, poll less often, up to the 10-minute idle interval.
+        delay = min(delay * quota.slowdown(), max(delay, 600))
+        logger.debug("Next calendar refresh in %ss", delay)
+        if args.emulate:
+            logger.debug("Emulator: %s", pool.stats())
+        # A worker joining or leaving wakes the loop, so the rooms move over at once.
+        nap(delay, shard.changed if shard else None)
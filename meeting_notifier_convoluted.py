@@ -1,29 +1,31 @@
 import json
 import os
+import re
 import sys
-import datetime
 import time
 import logging
-import subprocess
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import atexit
-import uuid
 import select
 import termios
 import tty
 
-from googleapiclient.discovery import build
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta
 import pytz
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.api_core.exceptions import AlreadyExists
-from google.oauth2 import service_account
-from google.cloud import pubsub_v1
-from google.apps import meet_v2
 from googleapiclient.errors import HttpError
-from google.iam.v1 import policy_pb2
+
+# The Google client libraries take seconds to import, so they are imported where they are
+# first used: the OAuth flow only in OAuth mode, Pub/Sub only by the functions that set it up.
+
+from startup_profile import StartupProfile
+from calendar_sync import CalendarSync
+from credential_pool import CredentialPool
+from state_db import StateDB
+from rooms import Room
+from alert_player import AlertEngine
+from meeting_state import MeetingRecord, MeetingStore
+from space_cache import SpaceCache
+from timeline import epoch
 
 
 # Constants
@@ -32,6 +34,9 @@ PROJECT_ID = "meeting-notifier-412417"
 ROOM_EMAIL = "c_188fmt6m2v6sahkjhd0kvdtkh12q6@resource.calendar.google.com"
 MP3_FILE = "alert.mp3"
 RETENTION_SECONDS = 60
+# Not meeting_notifier.py's notifier_state.db: both record their topic under the same key,
+# so sharing the file would have this script adopt, and with --cleanup delete, the other's.
+STATE_DB_FILE = "notifier_convoluted_state.db"
 
 # Logging
 logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -49,12 +54,12 @@ SA_FILE = 'service_account.json'
 OAUTH2_TOKEN_FILENAME = 'meeting_notifier_continuous_token.json'
 OAUTH2_CREDENTIALS_FILENAME = 'client_secrets.json'
 
-from google.auth.exceptions import RefreshError
-
-def get_meet_creds(use_sa=False, organizer=None):
-    if use_sa:
-        creds = service_account.Credentials.from_service_account_file(SA_FILE, scopes=SCOPES)
-        return creds.with_subject(organizer) if organizer else creds
+def get_meet_creds():
+    """OAuth2 user credentials. Called once, by the CredentialPool, when not using --sa_creds."""
+    from google.auth.exceptions import RefreshError
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
 
     def oauth_flow():
         logger.info("Starting browser-based OAuth2 flow...")
@@ -83,6 +88,9 @@ def get_meet_creds(use_sa=False, organizer=None):
 class Event:
     def __init__(self, event):
         self.event = event
+        # Parsed once, into epoch seconds, whatever offset the calendar wrote them in.
+        self.start_ts = epoch(self.start)
+        self.end_ts = epoch(self.end)
     def __repr__(self):
         return f"<Event {self.start} to {self.end} - {self.summary}>"
     @property
@@ -90,45 +98,39 @@ class Event:
         return self.event.get('conferenceData', {}).get('conferenceId')
     @property
     def start(self):
-        return self.event['start'].get('dateTime')
+        return self.event['start'].get('dateTime') or self.event['start'].get('date')
     @property
     def end(self):
-        return self.event['end'].get('dateTime')
+        return self.event['end'].get('dateTime') or self.event['end'].get('date')
     @property
     def ended(self):
-        event_end = datetime.fromisoformat(self.end)
-        if event_end.tzinfo is None:
-            event_end = event_end.replace(tzinfo=timezone.utc)
-        return event_end <= datetime.now(timezone.utc)
+        return self.end_ts <= time.time()
     @property
     def active(self):
         return self.started() and not self.ended()
     @property
+    def conference_version(self):
+        return self.event.get('conferenceData', {}).get('signature')
+    @property
     def summary(self):
         return self.event.get('summary', '(No Title)')
     @property
     def organizer_email(self):
         return self.event.get('creator', {}).get('email')
 
-def get_todays_meetings(creds, calendarId):
+def todays_window():
     tz = pytz.timezone('America/New_York')
     now = datetime.now(tz)
-    time_min = tz.localize(datetime(now.year, now.month, now.day)).isoformat()
-    time_max = (tz.localize(datetime(now.year, now.month, now.day)) + timedelta(days=1)).isoformat()
-
-    calendar_service = build("calendar", "v3", credentials=creds)
-    events_result = calendar_service.events().list(
-        calendarId=calendarId,
-        timeMin=time_min,
-        timeMax=time_max,
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
-    return [Event(e) for e in events_result.get('items', [])]
-
-def ensure_topic_and_permissions():
-    sa_creds = service_account.Credentials.from_service_account_file(SA_FILE)
-    publisher = pubsub_v1.PublisherClient(credentials=sa_creds)
+    midnight = tz.localize(datetime(now.year, now.month, now.day))
+    return midnight.isoformat(), (midnight + timedelta(days=1)).isoformat()
+
+def get_todays_meetings(sync):
+    time_min, time_max = todays_window()
+    return [Event(e) for e in sync.refresh(time_min, time_max)]
+
+def ensure_topic_and_permissions(pool):
+    from google.iam.v1 import policy_pb2
+    publisher = pool.publisher()
     topic_path = publisher.topic_path(PROJECT_ID, TOPIC_ID)
 
     try:
@@ -155,8 +157,7 @@ def ensure_topic_and_permissions():
     return topic_path
 
 
-def subscribe_to_meeting_space(meet_creds, space_id, topic_path):
-    workspace_service = build('workspaceevents', 'v1', credentials=meet_creds)
+def subscribe_to_meeting_space(workspace_service, space_id, topic_path):
     sub_name = f"subscriptions/meet-sub-{space_id.replace('/', '-')}"
     body = {
         "name": sub_name,
@@ -181,6 +182,7 @@ def subscribe_to_meeting_space(meet_creds, space_id, topic_path):
         return None
 
 def print_workspace_event_subscriptions(creds):
+    from googleapiclient.discovery import build
     logger.info("Listing current Workspace Events API subscriptions...")
     service = build("workspaceevents", "v1", credentials=creds)
 
@@ -208,10 +210,10 @@ def print_workspace_event_subscriptions(creds):
         logger.error("Failed to list subscriptions: %s", e)
 
 
-def start_pubsub_listener(subscription_path, meetings):
-    sa_creds = service_account.Credentials.from_service_account_file(SA_FILE)
-    logging.debug("sa_creds.email = %s",sa_creds.service_account_email)
-    subscriber = pubsub_v1.SubscriberClient(credentials=sa_creds)
+def start_pubsub_listener(subscription_path, meetings, pool, state):
+    from google.api_core.exceptions import AlreadyExists
+    logging.debug("sa_creds.email = %s", pool.sa_credentials.service_account_email)
+    subscriber = pool.subscriber()
 
     def callback(message):
         try:
@@ -225,38 +227,42 @@ def start_pubsub_listener(subscription_path, meetings):
 
             # Mark as joined if room joined
             if (event_type.endswith("joined") and
-                space_id in meetings and
-                participant_email.lower() == ROOM_EMAIL.lower()):
+                participant_email.lower() == ROOM_EMAIL.lower() and
+                meetings.mark_joined(space_id, ROOM_EMAIL)):
                 logger.info(f"✅ Room joined meeting: {space_id}")
-                meetings[space_id]["joined"] = True
 
             message.ack()
         except Exception as e:
             logger.error(f"PubSub message handling error: {e}")
             message.nack()
 
-    subscription_path = f"projects/{PROJECT_ID}/subscriptions/{TOPIC_ID}-sub"
-    try:
-        subscriber.create_subscription(name=subscription_path, topic=topic_path)
-    except AlreadyExists:
-        logger.info("Pub/Sub subscription already exists")
+    if state.resource("subscription") != {"name": subscription_path, "state": "active"}:
+        state.begin_resource("subscription", subscription_path)
+        try:
+            subscriber.create_subscription(name=subscription_path, topic=topic_path)
+        except AlreadyExists:
+            logger.info("Pub/Sub subscription already exists")
+        state.commit_resource("subscription", subscription_path)
     logger.info(f"Subscribing to Pub/Sub on {subscription_path}")
     subscriber.subscribe(subscription_path, callback=callback)
 
 
-from google.auth.transport.requests import AuthorizedSession
+ALERT_ROOM = Room("Conference room", ROOM_EMAIL)
+alerts = AlertEngine(MP3_FILE)
 
 def play_alert():
-    logger.warning("⚠️ Conference room has not joined a live meeting!")
-    subprocess.call(["afplay", MP3_FILE])  # macOS only; use mpg123 or aplay on Linux
+    alerts.alert(ALERT_ROOM)    # returns at once; playback runs on the room's alert thread
 
-def create_topic_and_configure(unique_topic_id):
-    sa_creds = service_account.Credentials.from_service_account_file(SA_FILE)
-    publisher = pubsub_v1.PublisherClient(credentials=sa_creds)
+def create_topic_and_configure(unique_topic_id, pool):
+    from google.api_core.exceptions import AlreadyExists
+    from google.iam.v1 import policy_pb2
+    publisher = pool.publisher()
     topic_path = publisher.topic_path(PROJECT_ID, unique_topic_id)
     try:
         publisher.create_topic(request={"name": topic_path})
         logger.info(f"Created topic: {topic_path}")
+    except AlreadyExists:
+        logger.info(f"Adopting topic left by an interrupted start: {topic_path}")
     except Exception as e:
         logger.error(f"Error creating topic: {e}")
         raise
@@ -273,11 +279,33 @@ def create_topic_and_configure(unique_topic_id):
         logger.info("Granted meet-api-event-push permission on topic")
     return topic_path, publisher
 
-def delete_topic_on_exit(topic_path, publisher):
+def bootstrap_topic(pool, state):
+    """Reuse the topic recorded by an earlier run, or create a new timestamped one."""
+    recorded = state.resource("topic")
+    if recorded and not re.fullmatch(r"meet-events-\d{14}", recorded["name"].split("/")[-1]):
+        raise SystemExit(f"{state.path} records {recorded['name']}, which this script didn't create; "
+                         "use a --state_db of its own")
+    if recorded and recorded["state"] == "active":
+        logger.info(f"Reusing topic: {recorded['name']}")
+        return recorded["name"], pool.publisher()
+    if recorded:
+        # A crash interrupted the creation of this topic; finish the job instead of starting another.
+        unique_topic_id = recorded["name"].split("/")[-1]
+    else:
+        unique_topic_id = f"meet-events-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    state.begin_resource("topic", f"projects/{PROJECT_ID}/topics/{unique_topic_id}")
+    topic_path, publisher = create_topic_and_configure(unique_topic_id, pool)
+    state.commit_resource("topic", topic_path)
+    return topic_path, publisher
+
+def delete_topic_on_exit(topic_path, publisher, state):
     def _delete():
         try:
             publisher.delete_topic(request={"topic": topic_path})
             logger.info(f"Deleted topic on exit: {topic_path}")
+            state.forget_resource("topic")
+            state.forget_resource("subscription")
+            state.delete("meetings")    # their Workspace Events subscriptions pointed at the topic
         except Exception as e:
             logger.warning(f"Failed to delete topic on exit: {e}")
     return _delete
@@ -288,11 +316,13 @@ def key_pressed():
         return sys.stdin.read(1)
     return None
 
-def do_work(meetings, config, calendar_creds, args, topic_path):
+def resolve_space(e, pool):
+    return pool.spaces_client(e.organizer_email).get_space(name=f"spaces/{e.conferenceId}").name
+
+def do_work(meetings, sync, pool, topic_path, space_cache):
     logger.info("loop again")
-    events = get_todays_meetings(calendar_creds, config['monitor_calendar_id'])
-    now = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
-    active = []
+    events = get_todays_meetings(sync)
+    records = {}
 
     for e in events:
         if not e.conferenceId:
@@ -301,42 +331,64 @@ def do_work(meetings, config, calendar_creds, args, topic_path):
         if e.ended:
             logger.debug("EVENT: %s has already ended", e)
             continue
-        meet_creds = get_meet_creds(args.sa_creds, e.organizer_email if args.sa_creds else None)
-        meet_client = meet_v2.SpacesServiceClient(credentials=meet_creds)
+        # Only a space the cache doesn't know (or whose conference changed) costs a Meet call.
+        space_id = space_cache.get(e.conferenceId, e.conference_version, lambda: resolve_space(e, pool))
+        if space_id is None:
+            continue
         try:
-            space = meet_client.get_space(name=f"spaces/{e.conferenceId}")
-            space_id = space.name
             logger.debug("EVENT: %s space_id: %s", e, space_id)
-            meetings[space_id].update({
-                'start': e.start,
-                'end': e.end,
-                'joined': False,
-                'summary': e.summary
-            })
-            if 'subscription' not in meetings[space_id]:
-                meetings[space_id]['subscription'] = subscribe_to_meeting_space(meet_creds, space_id, topic_path)
-            active.append(space_id)
+            known = meetings.get(space_id)
+            if known is not None:
+                subscription = known.subscription
+            else:
+                subscription = subscribe_to_meeting_space(
+                    pool.workspace_events(e.organizer_email), space_id, topic_path)
+            records[space_id] = MeetingRecord(space_id, e.start, e.end, e.summary, e.organizer_email,
+                                              subscription, rooms={ROOM_EMAIL: ALERT_ROOM},
+                                              start_ts=e.start_ts, end_ts=e.end_ts)
         except Exception as err:
-            logger.error(f"Error retrieving space for {e.conferenceId}: {err}")
+            logger.error(f"Error subscribing to {space_id}: {err}")
 
     # Remove inactive meetings
-    inactive = set(meetings.keys()) - set(active)
-    for sid in inactive:
+    for sid in set(meetings.snapshot()) - set(records):
         logger.debug(f"Removing expired meeting: {sid}")
-        meetings.pop(sid)
-
-    # Detect live meetings without room joined
-    for sid, meta in meetings.items():
-        if meta['start'] < now < meta['end'] and not meta['joined']:
+    # The records are built with no joins; replace() carries over the joins the Pub/Sub
+    # callback recorded, even during this pass, so a refresh never reverts a join.
+    meetings.replace(records)
+
+    # Detect live meetings without room joined. The times are compared as epoch seconds:
+    # comparing the calendar's "-04:00" strings with a UTC "Z" string got it wrong.
+    snapshot = meetings.snapshot()
+    for sid in meetings.live(time.time()):
+        if not snapshot[sid].joined:
             play_alert()
 
-def main_loop(meetings, config, calendar_creds, args, topic_path):
+def restore_state(state, meetings, space_cache):
+    """Load the meetings (with their Workspace Events subscriptions) and spaces the last run saved."""
+    spaces = state.get("spaces")
+    if spaces:
+        space_cache.load(spaces["entries"], age=time.time() - spaces["saved_at"])
+    saved_meetings = state.get("meetings")
+    if saved_meetings:
+        rooms_by_email = {ALERT_ROOM.room_email: ALERT_ROOM}
+        meetings.replace({m['space_id']: MeetingRecord.from_dict(m, rooms_by_email) for m in saved_meetings})
+        logger.info("Restored %d meeting(s) from %s", len(meetings), state.path)
+
+def save_state(state, meetings, space_cache, sync):
+    values = {"meetings": [m.to_dict() for m in meetings.snapshot().values()],
+              "spaces": {"saved_at": time.time(), "entries": space_cache.dump()}}
+    if sync.changed:
+        values[f"calendar:{sync.calendar_id}"] = sync.state()
+    state.put_many(values)
+
+def main_loop(meetings, sync, pool, topic_path, state, space_cache):
     fd = sys.stdin.fileno()
     old_settings = termios.tcgetattr(fd)
     try:
         tty.setcbreak(fd)
         while True:
-            do_work(meetings, config, calendar_creds, args, topic_path)
+            do_work(meetings, sync, pool, topic_path, space_cache)
+            save_state(state, meetings, space_cache, sync)
             print('\r\033[7mtype q to exit\033[0m', end='', flush=True)
             for _ in range(5):
                 key = key_pressed()
@@ -354,24 +406,52 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--sa_creds", action="store_true")
+    parser.add_argument("--state_db", default=STATE_DB_FILE, help="local state for warm restarts")
+    parser.add_argument("--cleanup", action="store_true", help="delete the topic on exit instead of keeping it for the next run")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="log how long each import and bootstrap phase took")
     args = parser.parse_args()
     if args.debug:
         logger.setLevel(logging.DEBUG)
-
-    with open("notifier_config.json") as f:
-        config = json.load(f)
-
-    meet_creds = get_meet_creds(args.sa_creds)
-    meetings = defaultdict(dict)
-
-    topic_suffix = datetime.now().strftime("%Y%m%d%H%M%S")
-    unique_topic_id = f"meet-events-{topic_suffix}"
-
-    topic_path, publisher = create_topic_and_configure(unique_topic_id)
-    atexit.register(delete_topic_on_exit(topic_path, publisher))
-
-    subscription_path = f"projects/{PROJECT_ID}/subscriptions/{unique_topic_id}-sub"
-    start_pubsub_listener(subscription_path, meetings)
-    calendar_creds = service_account.Credentials.from_service_account_file(SA_FILE, scopes=SCOPES)
-
-    main_loop(meetings, config, calendar_creds, args, topic_path)
+    profile = StartupProfile(args.startup_profile)
+
+    with profile.phase("config + local state"):
+        with open("notifier_config.json") as f:
+            config = json.load(f)
+        meetings = MeetingStore()
+        space_cache = SpaceCache()
+        state = StateDB(args.state_db)
+        restore_state(state, meetings, space_cache)
+
+    with profile.phase("alert sound"):
+        alerts.preload([ALERT_ROOM.alert_sink])
+
+    with profile.phase("credentials"):
+        pool = CredentialPool(SA_FILE, SCOPES, use_sa=args.sa_creds, oauth_loader=get_meet_creds)
+        pool.credentials()      # run the OAuth flow, if needed, before anything else
+        pool.start()
+
+    def bootstrap_pubsub():
+        global topic_path       # start_pubsub_listener subscribes to the module-level topic_path
+        topic_path, publisher = bootstrap_topic(pool, state)
+        if args.cleanup:
+            atexit.register(delete_topic_on_exit(topic_path, publisher, state))
+        subscription_path = f"projects/{PROJECT_ID}/subscriptions/{topic_path.split('/')[-1]}-sub"
+        start_pubsub_listener(subscription_path, meetings, pool, state)
+
+    def bootstrap_calendar():
+        sync = CalendarSync(pool.calendar_service(), config['monitor_calendar_id'])
+        saved = state.get(f"calendar:{sync.calendar_id}")
+        if saved:
+            sync.restore(saved)
+        return sync
+
+    # The topic and subscription don't depend on the calendar, so they are set up side by side.
+    with profile.phase("parallel bootstrap"), ThreadPoolExecutor(thread_name_prefix="bootstrap") as bootstrap:
+        pubsub_ready = bootstrap.submit(profile.timed("topic, IAM and pubsub listener", bootstrap_pubsub))
+        calendar_ready = bootstrap.submit(profile.timed("calendar service", bootstrap_calendar))
+        pubsub_ready.result()
+        sync = calendar_ready.result()
+    profile.report()
+
+    main_loop(meetings, sync, pool, topic_path, state, space_cache)
@@ -0,0 +1,106 @@
+"""
+The set of meetings being watched, shared by the main loop, the Pub/Sub callback threads
+and the alert scheduler.
+
+Records are never modified once they are published. Every change (a calendar refresh, a
+room joining) builds a new dict under a lock and swaps it in, so readers just grab the
+current dict and never take the lock or see a half-applied update. Joins are monotonic:
+replace() carries the joined rooms of surviving meetings forward, so a refresh that was
+built before a join can't undo it. replace() also rebuilds the Timeline of the meetings'
+start and end times (timeline.py), which joins don't change.
+"""
+
+import threading
+from types import MappingProxyType
+
+from timeline import Timeline, epoch
+
+
+class MeetingRecord:
+    __slots__ = ('space_id', 'start', 'end', 'summary', 'organizer', 'subscription', 'rooms', 'joined',
+                 'start_ts', 'end_ts')
+
+    def __init__(self, space_id, start, end, summary=None, organizer=None, subscription=None,
+                 rooms=None, joined=frozenset(), start_ts=None, end_ts=None):
+        self.space_id = space_id
+        self.start = start
+        self.end = end
+        self.start_ts = epoch(start) if start_ts is None else start_ts     # epoch seconds
+        self.end_ts = epoch(end) if end_ts is None else end_ts
+        self.summary = summary
+        self.organizer = organizer
+        self.subscription = subscription
+        self.rooms = rooms if rooms is not None else {}     # room_email -> Room
+        self.joined = frozenset(joined)                     # room emails that have joined
+
+    def __repr__(self):
+        return f"<Meeting {self.space_id} {self.start} to {self.end} - {self.summary} joined={sorted(self.joined)}>"
+
+    def copy(self, **changes):
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return MeetingRecord(**fields)
+
+    def to_dict(self):
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields['rooms'] = sorted(self.rooms)
+        fields['joined'] = sorted(self.joined)
+        return fields
+
+    @classmethod
+    def from_dict(cls, fields, rooms_by_email):
+        """Inverse of to_dict(). Rooms that are no longer configured are dropped."""
+        fields = dict(fields)
+        fields['rooms'] = {e: rooms_by_email[e] for e in fields['rooms'] if e in rooms_by_email}
+        return cls(**fields)
+
+    def unjoined_rooms(self):
+        return [room for email, room in self.rooms.items() if email not in self.joined]
+
+
+class MeetingStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meetings = MappingProxyType({})    # space_id -> MeetingRecord
+        self.timeline = Timeline()              # of space_ids
+
+    def __contains__(self, space_id):
+        return space_id in self.meetings
+
+    def __len__(self):
+        return len(self.meetings)
+
+    def get(self, space_id):
+        return self.meetings.get(space_id)
+
+    def live(self, now):
+        """space_ids of the meetings under way at now."""
+        return self.timeline.live(now)
+
+    def snapshot(self):
+        """A read-only space_id -> MeetingRecord mapping that will not change under the caller."""
+        return self.meetings
+
+    def replace(self, records):
+        """Make records (space_id -> MeetingRecord) the meetings being watched."""
+        with self.lock:
+            current = self.meetings
+            new = {}
+            for space_id, record in records.items():
+                old = current.get(space_id)
+                if old is not None and not old.joined <= record.joined:
+                    record = record.copy(joined=old.joined | record.joined)
+                new[space_id] = record
+            self.meetings = MappingProxyType(new)
+            self.timeline = Timeline((r.start_ts, r.end_ts, space_id) for space_id, r in new.items())
+
+    def mark_joined(self, space_id, room_email):
+        """Record that a room joined. Returns False if it was already recorded or the meeting is unknown."""
+        with self.lock:
+            record = self.meetings.get(space_id)
+            if record is None or room_email in record.joined:
+                return False
+            new = dict(self.meetings)
+            new[space_id] = record.copy(joined=record.joined | {room_email})
+            self.meetings = MappingProxyType(new)
+            return True
@@ -0,0 +1,211 @@
+"""
+Counters, gauges and histograms, served in the Prometheus text format.
+
+Metrics are module-level, like the Prometheus client library's default registry, so any
+module can record without having something passed in. Every call to a Google API goes
+through api_call(), which times it into google_api_seconds{api=...} and counts failures in
+google_api_errors_total{api=..., code=...}. serve(port) answers GET /metrics on 127.0.0.1
+from a daemon thread (`meeting_notifier.py --metrics-port 9464`, and --metrics-address to
+listen elsewhere).
+
+Only the standard library is used; if nothing is served, recording costs a lock and a few
+additions.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+LAG_BUCKETS = (.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300)
+MEETING_BUCKETS = (5, 15, 30, 60, 120, 300, 600, 1800)
+
+
+def _label_text(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help):
+        super().__init__(name, help)
+        self.values = {}        # label items -> count
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return self.header() + [f"{self.name}{_label_text(k)} {v}" for k, v in values]
+
+
+class Gauge(Metric):
+    """A value read when /metrics is scraped."""
+    kind = "gauge"
+
+    def __init__(self, name, help, func=None):
+        super().__init__(name, help)
+        self.func = func
+        self.current = 0
+
+    def set(self, value):
+        self.current = value
+
+    def set_function(self, func):
+        self.func = func
+
+    def render(self):
+        try:
+            value = self.func() if self.func else self.current
+        except Exception as e:
+            logger.debug("Gauge %s failed: %s", self.name, e)
+            return []
+        return self.header() + [f"{self.name} {value}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+        self.series = {}        # label items -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        series = self.series.get(tuple(sorted(labels.items())))
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        with self.lock:
+            series = {k: list(v) for k, v in sorted(self.series.items())}
+        lines = self.header()
+        for key, counts in series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts[:-1]):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_label_text(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(key)} {counts[-1]}")
+            lines.append(f"{self.name}_count{_label_text(key)} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+API_SECONDS = Histogram("google_api_seconds", "Latency of Google API calls, by API method.")
+API_ERRORS = Counter("google_api_errors_total", "Google API calls that failed, by API method and HTTP status.")
+DELIVERY_LAG = Histogram("pubsub_delivery_lag_seconds", "From Pub/Sub publish_time to the callback.", LAG_BUCKETS)
+CALLBACK_SECONDS = Histogram("pubsub_callback_seconds", "Time spent handling one Pub/Sub message.")
+MESSAGES = Counter("pubsub_messages_total", "Pub/Sub messages, by outcome (ack, nack, duplicate, ignored).")
+LOOP_SECONDS = Histogram("main_loop_seconds", "Duration of one calendar poll and reconcile cycle.")
+CYCLE_LATE = Counter("main_loop_late_total", "Work still running at the main loop's deadline, by kind.")
+JOIN_DELAY = Histogram("meeting_join_delay_seconds", "From meeting start to the room joining (0 if early).",
+                       MEETING_BUCKETS)
+ALERT_DELAY = Histogram("meeting_alert_delay_seconds", "From meeting start to the room's first alert.",
+                        MEETING_BUCKETS)
+ALERTS = Counter("alerts_total", "Alerts requested, by room.")
+JOINS = Counter("meeting_joins_total", "Rooms seen joining a meeting, by detector (events, poll).")
+
+
+def error_code(e):
+    """HTTP status of an API error if there is one, else the exception's class name."""
+    resp = getattr(e, 'resp', None)
+    if resp is not None and getattr(resp, 'status', None):
+        return str(resp.status)
+    code = getattr(e, 'code', None)
+    if isinstance(code, int):
+        return str(code)
+    return type(e).__name__
+
+
+@contextmanager
+def api_call(api):
+    """Time a Google API call and count it as an error if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        API_ERRORS.inc(api=api, code=error_code(e))
+        raise
+    finally:
+        API_SECONDS.observe(time.perf_counter() - start, api=api)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics: " + format, *args)
+
+
+def serve(port, address="127.0.0.1"):
+    """
+    Serve /metrics on port from a daemon thread. Returns the server.
+    Only on the loopback interface by default: the metrics name rooms and meetings.
+    """
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Serving metrics on http://%s:%d/metrics", address or "0.0.0.0", server.server_port)
+    return server
@@ -0,0 +1,155 @@
+"""
+Turn participant resource names into identities.
+
+Meet events only carry a participantSession name such as
+conferenceRecords/abc/participants/123/participantSessions/4, so to tell whether the room
+joined we have to look the participant up with the ConferenceRecordsService. Lookups are
+cached for the life of the conference record (until conference.ended), concurrent lookups
+of the same participant share one API call, and conference.started triggers a background
+list_participants() so most lookups are already answered by the time anyone joins.
+"""
+
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import quota
+
+logger = logging.getLogger(__name__)
+
+
+def conference_record_of(name):
+    """conferenceRecords/abc/participants/... -> conferenceRecords/abc"""
+    return "/".join(name.split("/")[:2])
+
+
+def participant_of(name):
+    """conferenceRecords/abc/participants/123/participantSessions/4 -> conferenceRecords/abc/participants/123"""
+    return "/".join(name.split("/")[:4])
+
+
+class ParticipantIdentity:
+    __slots__ = ('name', 'user', 'display_name')
+
+    def __init__(self, name, user=None, display_name=None):
+        self.name = name                    # conferenceRecords/.../participants/...
+        self.user = user                    # users/{id} for signed-in users
+        self.display_name = display_name
+
+    def __repr__(self):
+        return f"<Participant {self.user or '-'} {self.display_name!r}>"
+
+    @classmethod
+    def from_participant(cls, p):
+        for kind in ('signedin_user', 'anonymous_user', 'phone_user'):
+            if kind in p:
+                who = getattr(p, kind)
+                return cls(p.name, getattr(who, 'user', None) or None, who.display_name)
+        return cls(p.name)
+
+
+class ParticipantResolver:
+    def __init__(self, client_for, max_workers=4):
+        """
+        :param client_for: client_for(subject) returns a ConferenceRecordsServiceClient that can
+                           read the organizer's conference records.
+        """
+        self.client_for = client_for
+        self.lock = threading.Lock()
+        self.records = {}       # conference record -> {participant name: ParticipantIdentity}
+        self.inflight = {}      # participant name or conference record -> Future
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="participants")
+        self.api_calls = 0
+        self.on_resolved = None     # called with every identity fetched from the API (see event_log.py)
+
+    def cached(self, participant_name):
+        with self.lock:
+            return self.records.get(conference_record_of(participant_name), {}).get(participant_name)
+
+    def _single_flight(self, key, fetch):
+        """Run fetch() once per key, however many threads ask at the same time."""
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            with self.lock:
+                self.api_calls += 1
+            result = fetch()
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+    def resolve(self, name, subject=None):
+        """Return the ParticipantIdentity for a participant or participant session name."""
+        participant_name = participant_of(name)
+        record = conference_record_of(participant_name)
+        identity = self.cached(participant_name)
+        if identity:
+            return identity
+        with self.lock:
+            listing = self.inflight.get(record)
+        if listing:
+            # A prefetch of the whole record is under way; it will almost certainly include us.
+            try:
+                listing.result()
+            except Exception:
+                pass
+            identity = self.cached(participant_name)
+            if identity:
+                return identity
+
+        def fetch():
+            client = self.client_for(subject)
+            p = quota.call("meet.get_participant", lambda: client.get_participant(name=participant_name))
+            return ParticipantIdentity.from_participant(p)
+        identity = self._single_flight(participant_name, fetch)
+        with self.lock:
+            self.records.setdefault(record, {})[participant_name] = identity
+        if self.on_resolved:
+            self.on_resolved(identity)
+        return identity
+
+    def prefetch(self, record, subject=None):
+        """List every participant of a conference record in the background."""
+        def fetch():
+            found = {}
+            client = self.client_for(subject)
+            # list() so that every page is fetched inside the call.
+            for p in quota.call("meet.list_participants", lambda: list(client.list_participants(parent=record))):
+                found[p.name] = ParticipantIdentity.from_participant(p)
+            with self.lock:
+                self.records.setdefault(record, {}).update(found)
+            if self.on_resolved:
+                for identity in found.values():
+                    self.on_resolved(identity)
+            logger.debug("Prefetched %d participants of %s", len(found), record)
+            return found
+
+        def run():
+            try:
+                self._single_flight(record, fetch)
+            except Exception as e:
+                logger.warning("Could not list participants of %s: %s", record, e)
+        return self.executor.submit(run)
+
+    def remember(self, record, identities):
+        """Cache identities listed elsewhere (see join_poller.py) for a conference record."""
+        with self.lock:
+            self.records.setdefault(record, {}).update((identity.name, identity) for identity in identities)
+        if self.on_resolved:
+            for identity in identities:
+                self.on_resolved(identity)
+
+    def forget(self, record):
+        """Drop the cache for a conference record that has ended."""
+        with self.lock:
+            self.records.pop(record, None)
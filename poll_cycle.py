@@ -0,0 +1,104 @@
+"""
+One pass of the main loop's calendar work, run concurrently and under a deadline.
+
+For every room the calendar is refreshed, and for every upcoming event the Meet space is
+resolved. Done one after another, a single slow Meet call held up every other meeting. Here:
+  - each room's refresh runs on the calendar pool, and each event's space lookup is handed
+    to the meet pool as soon as its room's events are in;
+  - each call has its own timeout (given to the Meet client; the REST calls have their
+    transport's socket timeout);
+  - the whole pass has a deadline. Work still running at the deadline is not waited for:
+    the room's events, or the event's space, from the previous pass stand in for it, and
+    the late result is picked up by a later pass (from the calendar index, or the
+    SpaceCache). A room whose refresh is still running isn't refreshed again until it ends.
+The results are gathered into a new list and only handed back at the end of the pass, so
+the caller replaces the MeetingStore and saves state in one step, as before.
+"""
+
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PollCycle:
+    def __init__(self, refresh, resolve, calendar_pool, meet_pool, deadline=30, clock=time.monotonic):
+        """
+        :param refresh: refresh(room) -> the room's Event list.
+        :param resolve: resolve(event) -> space_id, or None if it has none.
+        """
+        self.refresh = refresh
+        self.resolve = resolve
+        self.calendar_pool = calendar_pool
+        self.meet_pool = meet_pool
+        self.deadline = deadline
+        self.clock = clock
+        self.pending = {}       # room -> refresh future that outlived its pass
+        self.events = {}        # room -> events from its last finished refresh
+        self.spaces = {}        # conferenceId -> space_id found by the last pass
+        self.ends = None
+
+    def __repr__(self):
+        return f"<PollCycle {len(self.events)} rooms, {len(self.pending)} late>"
+
+    def remaining(self):
+        """Seconds left before the current pass's deadline."""
+        return max(self.ends - self.clock(), 0) if self.ends else self.deadline
+
+    def run(self, rooms, wanted=lambda event: True):
+        """[(room, event, space_id)] for the events `wanted` accepts whose space is known, by room."""
+        self.ends = self.clock() + self.deadline
+        refreshes = {}
+        for room in rooms:
+            future = self.pending.pop(room, None)
+            if future is None or future.done():
+                future = self.calendar_pool.submit(self.refresh, room)
+            refreshes[future] = room
+
+        lookups = {}            # conferenceId -> future
+        events = {}             # room -> its wanted events this pass
+        left = set(refreshes)
+        while left:
+            done, left = wait(left, timeout=self.remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                room = refreshes[future]
+                try:
+                    self.events[room] = future.result()
+                except Exception as e:
+                    logger.error("Could not refresh the calendar of %s: %s", room, e)
+                events[room] = self._lookup(room, lookups, wanted)
+        for future in left:
+            room = refreshes[future]
+            logger.warning("Calendar refresh of %s is late; using its last events", room)
+            metrics.CYCLE_LATE.inc(work="calendar")
+            self.pending[room] = future
+            events[room] = self._lookup(room, lookups, wanted)
+
+        _, late = wait(lookups.values(), timeout=self.remaining())
+        spaces = {}
+        for conference_id, future in lookups.items():
+            if future in late:
+                metrics.CYCLE_LATE.inc(work="space")
+                space_id = self.spaces.get(conference_id)
+            else:
+                space_id = future.result()
+            if space_id is not None:
+                spaces[conference_id] = space_id
+        if late:
+            logger.warning("%d space lookup(s) late; using what the last pass found", len(late))
+        self.spaces = spaces
+        return [(room, e, spaces[e.conferenceId]) for room in rooms for e in events.get(room, ())
+                if e.conferenceId in spaces]
+
+    def _lookup(self, room, lookups, wanted):
+        """Start the space lookups for the room's wanted events. Returns those events."""
+        events = [e for e in self.events.get(room, []) if wanted(e)]
+        for e in events:
+            if e.conferenceId not in lookups:
+                lookups[e.conferenceId] = self.meet_pool.submit(self.resolve, e)
+        return events
@@ -0,0 +1,203 @@
+"""
+Receive the Pub/Sub messages for the callback, in one of two ways.
+
+StreamingListener keeps a streaming pull open, like subscriber.subscribe() on its own, but:
+  - FlowControl caps the messages and bytes held by the client at once (max_messages,
+    max_bytes) and how long a message's lease is extended (max_lease_seconds);
+  - the callbacks run on a pool of `threads` threads instead of the library's default;
+  - a supervisor thread waits on the streaming-pull future and, when the stream dies,
+    opens a new one after a backoff (restart_delay, doubling up to max_restart_delay).
+    The library shuts the pool down with the stream, so each stream gets a new one.
+
+BatchPuller uses synchronous pull instead: it pulls up to `batch` messages, runs the
+callback on each in turn on its own thread, then acknowledges the acked ones in a single
+request and hands the nacked ones straight back. A slow callback (a Meet API lookup)
+therefore holds up the rest of its batch. There is no gRPC stream and no thread pool, which
+suits small hosts; a message waits at most `interval` seconds between polls when the
+subscription is idle.
+
+The third mode, "push", has Pub/Sub deliver to an HTTP endpoint; see push_receiver.py.
+
+All are configured from the "pubsub" section of notifier_config.json, e.g.
+    {"pubsub": {"mode": "pull", "batch": 50}}
+    {"pubsub": {"max_messages": 200, "max_bytes": 10485760, "threads": 4}}
+    {"pubsub": {"mode": "push", "port": 8080, "audience": "https://notifier.example.com/push"}}
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RESTARTS = metrics.Counter("pubsub_stream_restarts_total", "Streaming pulls reopened after the stream died.")
+PULL_BATCH = metrics.Histogram("pubsub_pull_batch_size", "Messages returned by one synchronous pull.",
+                               (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000))
+
+
+class StreamingListener:
+    def __init__(self, subscriber, subscription_path, callback, max_messages=100, max_bytes=10 << 20,
+                 max_lease_seconds=600, threads=4, restart_delay=1, max_restart_delay=60):
+        self.subscriber = subscriber
+        self.subscription_path = subscription_path
+        self.callback = callback
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_lease_seconds = max_lease_seconds
+        self.threads = threads
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.future = None
+        self.restarts = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __repr__(self):
+        return f"<StreamingListener {self.subscription_path} {self.restarts} restarts>"
+
+    def _open(self):
+        from google.cloud import pubsub_v1
+        from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+        flow_control = pubsub_v1.types.FlowControl(max_messages=self.max_messages, max_bytes=self.max_bytes,
+                                                   max_lease_duration=self.max_lease_seconds)
+        executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="pubsub-callback")
+        return self.subscriber.subscribe(self.subscription_path, callback=self.callback,
+                                         flow_control=flow_control, scheduler=ThreadScheduler(executor))
+
+    def start(self):
+        """Open the stream (raising if that fails) and start supervising it."""
+        self.future = self._open()
+        self.thread = threading.Thread(target=self.supervise, name="pubsub-supervisor", daemon=True)
+        self.thread.start()
+        return self
+
+    def supervise(self):
+        delay = self.restart_delay
+        while True:
+            opened = time.monotonic()
+            try:
+                self.future.result()
+                reason = "closed"
+            except Exception as e:
+                reason = f"failed: {e!r}"
+            if self.stopped.is_set():
+                return
+            # A stream that stayed up a while was healthy; start the backoff over.
+            if time.monotonic() - opened > self.max_restart_delay:
+                delay = self.restart_delay
+            logger.warning("Pub/Sub stream on %s %s; reopening in %ss", self.subscription_path, reason, delay)
+            while not self.stopped.wait(delay):
+                try:
+                    self.future = self._open()
+                    break
+                except Exception as e:
+                    logger.error("Could not reopen the Pub/Sub stream: %s", e)
+                    delay = min(delay * 2, self.max_restart_delay)
+            else:
+                return
+            self.restarts += 1
+            RESTARTS.inc()
+            delay = min(delay * 2, self.max_restart_delay)
+
+    def stop(self):
+        self.stopped.set()
+        if self.future:
+            self.future.cancel()
+
+
+class PulledMessage:
+    """A synchronously pulled message, with the ack()/nack() the callback expects."""
+    __slots__ = ('ack_id', 'message_id', 'publish_time', 'attributes', 'data', 'acked')
+
+    def __init__(self, received):
+        self.ack_id = received.ack_id
+        message = received.message
+        self.message_id = message.message_id
+        self.publish_time = message.publish_time
+        self.attributes = message.attributes
+        self.data = message.data
+        self.acked = None
+
+    def ack(self):
+        self.acked = True
+
+    def nack(self):
+        self.acked = False
+
+
+class BatchPuller:
+    def __init__(self, subscriber, subscription_path, callback, batch=50, interval=1.0, timeout=30,
+                 clock=time):
+        self.subscriber = subscriber
+        self.subscription_path = subscription_path
+        self.callback = callback
+        self.batch = batch
+        self.interval = interval
+        self.timeout = timeout
+        self.clock = clock
+        self.pulled = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __repr__(self):
+        return f"<BatchPuller {self.subscription_path} {self.pulled} pulled>"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="pubsub-puller", daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                n = self.pull_once()
+            except Exception as e:
+                logger.error("Pub/Sub pull on %s failed: %s", self.subscription_path, e)
+                n = 0
+            if not n:
+                self.clock.sleep(self.interval)
+
+    def pull_once(self):
+        """Pull, handle and acknowledge one batch. Returns the number of messages."""
+        response = self.subscriber.pull(request={"subscription": self.subscription_path,
+                                                 "max_messages": self.batch}, timeout=self.timeout)
+        messages = [PulledMessage(r) for r in response.received_messages]
+        PULL_BATCH.observe(len(messages))
+        self.pulled += len(messages)
+        for message in messages:
+            try:
+                self.callback(message)
+            except Exception as e:
+                logger.error("Callback failed on %s: %s", message.message_id, e)
+                message.nack()
+        acks = [m.ack_id for m in messages if m.acked]
+        # Unanswered messages are handed back too, rather than waiting out the ack deadline.
+        nacks = [m.ack_id for m in messages if not m.acked]
+        if acks:
+            with metrics.api_call("pubsub.acknowledge"):
+                self.subscriber.acknowledge(request={"subscription": self.subscription_path, "ack_ids": acks})
+        if nacks:
+            with metrics.api_call("pubsub.modify_ack_deadline"):
+                self.subscriber.modify_ack_deadline(request={"subscription": self.subscription_path,
+                                                             "ack_ids": nacks, "ack_deadline_seconds": 0})
+        return len(messages)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_listener(subscriber, subscription_path, callback, settings=None, clock=time):
+    """Start the receiver chosen by settings (the config's "pubsub" section). Returns it."""
+    settings = dict(settings or {})
+    mode = settings.pop('mode', 'streaming')
+    if mode == 'pull':
+        return BatchPuller(subscriber, subscription_path, callback, clock=clock, **settings).start()
+    if mode == 'push':
+        from push_receiver import PushReceiver
+        return PushReceiver(callback, **settings).start()
+    if mode != 'streaming':
+        raise ValueError(f"pubsub mode must be 'streaming', 'pull' or 'push', not {mode!r}")
+    return StreamingListener(subscriber, subscription_path, callback, **settings).start()
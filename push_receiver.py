@@ -0,0 +1,296 @@
+"""
+Receive Pub/Sub push deliveries over HTTP, on one asyncio event loop.
+
+Point a push subscription at https://<host>/push (TLS is left to a proxy or load balancer
+in front). Each POST is a Pub/Sub push envelope:
+    {"message": {"messageId": ..., "publishTime": ..., "attributes": {...}, "data": <base64>},
+     "subscription": ...}
+Workspace Events payloads POSTed directly as binary-mode CloudEvents (ce-* headers, the
+event JSON as the body) are accepted too. Either way the message goes to the same callback
+the streaming pull uses, and its ack() or nack() becomes the response: 204 acknowledges,
+503 makes Pub/Sub deliver it again later.
+
+Requests are verified with either or both of the following; with neither, anything that
+can reach the port could post fake joins, so the receiver only listens on 127.0.0.1 (for a
+proxy on the same host that does the checking) and refuses any other host:
+  - token: a shared secret, passed as ?token=... in the push endpoint URL;
+  - audience: the push subscription's authentication audience. The bearer token must then
+    be an OIDC token signed by Google for that audience, and, if service_account is set,
+    issued to that service account. Pub/Sub reuses a token for up to an hour, so each one
+    is only checked once.
+
+Connections, HTTP parsing and token checks run on the event loop, so a connection costs a
+few KB; the callbacks run on a small thread pool because they may call the Meet API.
+start() runs the loop on its own thread, next to the notifier's main loop.
+"""
+
+import asyncio
+import base64
+import hmac
+import json
+import logging
+import re
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+REQUESTS = metrics.Counter("pubsub_push_requests_total", "Push requests answered, by HTTP status.")
+CONNECTIONS = metrics.Gauge("pubsub_push_connections", "Open push connections.")
+
+LOOPBACK = "127.0.0.1"
+REASONS = {204: "No Content", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+           405: "Method Not Allowed", 411: "Length Required", 413: "Payload Too Large",
+           503: "Service Unavailable"}
+
+
+def parse_time(text):
+    """RFC 3339 time as Pub/Sub writes it (nanoseconds, "Z") -> aware datetime."""
+    if not text:
+        return None
+    return datetime.fromisoformat(re.sub(r"(\.\d{6})\d+", r"\1", text).replace("Z", "+00:00"))
+
+
+class PushMessage:
+    """A pushed message, with the ack()/nack() the callback expects."""
+    __slots__ = ('message_id', 'publish_time', 'attributes', 'data', 'acked')
+
+    def __init__(self, message_id, publish_time, attributes, data):
+        self.message_id = message_id
+        self.publish_time = publish_time
+        self.attributes = attributes
+        self.data = data
+        self.acked = None
+
+    @classmethod
+    def from_envelope(cls, body):
+        message = json.loads(body)['message']
+        return cls(message.get('messageId') or message.get('message_id'),
+                   parse_time(message.get('publishTime') or message.get('publish_time')),
+                   message.get('attributes') or {},
+                   base64.b64decode(message.get('data', '')))
+
+    @classmethod
+    def from_cloudevent(cls, headers, body):
+        attributes = {k: v for k, v in headers.items() if k.startswith("ce-")}
+        return cls(attributes.get('ce-id'), parse_time(attributes.get('ce-time')), attributes, body)
+
+    def ack(self):
+        self.acked = True
+
+    def nack(self):
+        self.acked = False
+
+
+def push_envelope(message, subscription=None):
+    """The push request body for a message (anything with message_id, publish_time, attributes, data)."""
+    return json.dumps({'message': {'messageId': message.message_id,
+                                   'publishTime': message.publish_time.isoformat() if message.publish_time else None,
+                                   'attributes': dict(message.attributes),
+                                   'data': base64.b64encode(message.data).decode()},
+                       'subscription': subscription}).encode()
+
+
+class PushReceiver:
+    def __init__(self, callback, host=None, port=8080, path="/push", token=None, audience=None,
+                 service_account=None, threads=4, max_body=1 << 20, idle_timeout=120):
+        """
+        :param host: address to listen on. Default: all of them if token or audience is set,
+                     else 127.0.0.1.
+        """
+        if host is None:
+            host = "" if token or audience else LOOPBACK
+        elif host not in (LOOPBACK, "localhost") and not (token or audience):
+            raise ValueError(f"Refusing to accept unverified pushes on {host or 'all addresses'}: "
+                             "set a token or an audience")
+        self.callback = callback
+        self.host = host
+        self.port = port
+        self.path = path
+        self.token = token
+        self.audience = audience
+        self.service_account = service_account
+        self.max_body = max_body
+        self.idle_timeout = idle_timeout
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="push-callback")
+        self.verified = {}          # bearer token -> expiry (epoch seconds)
+        self.google_request = None
+        self.connections = 0
+        self.writers = set()
+        self.requests = 0
+        self.loop = None
+        self.server = None
+        self.ready = threading.Event()
+        self.error = None
+        CONNECTIONS.set_function(lambda: self.connections)
+
+    def __repr__(self):
+        return f"<PushReceiver {self.url} {self.requests} requests>"
+
+    @property
+    def url(self):
+        return f"http://{self.host or LOOPBACK}:{self.port}{self.path}"
+
+    # Running
+
+    def start(self):
+        """Listen on a thread of its own. Returns once the port is open (raising if it can't be)."""
+        threading.Thread(target=self.run, name="push-receiver", daemon=True).start()
+        self.ready.wait()
+        if self.error:
+            raise self.error
+        logger.info("Receiving Pub/Sub push on %s", self.url)
+        return self
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        try:
+            self.server = await asyncio.start_server(self.connection, self.host or None, self.port)
+        except OSError as e:
+            self.error = e
+            self.ready.set()
+            return
+        # With port 0 each address family gets its own port; url names the IPv4 one.
+        sockets = sorted(self.server.sockets, key=lambda s: s.family != socket.AF_INET)
+        self.port = sockets[0].getsockname()[1]
+        self.ready.set()
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def stop(self):
+        if self.loop and self.server:
+            self.loop.call_soon_threadsafe(self.close)
+        self.executor.shutdown(wait=False)
+
+    def close(self):
+        self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+
+    # HTTP
+
+    async def connection(self, reader, writer):
+        self.connections += 1
+        self.writers.add(writer)
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), self.idle_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+                status, keep_alive = request[0], False
+                if status is None:
+                    _, method, target, headers, body = request
+                    status = await self.handle(method, target, headers, body)
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                self.requests += 1
+                REQUESTS.inc(code=str(status))
+                close = "" if keep_alive else "Connection: close\r\n"
+                writer.write(f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Length: 0\r\n{close}\r\n".encode())
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            self.writers.discard(writer)
+            writer.close()
+
+    async def read_request(self, reader):
+        """(None, method, target, headers, body), or (status,) for a request to refuse, or None at EOF."""
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode('latin-1').split(None, 2)
+        except ValueError:
+            return (400,)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if 'content-length' not in headers:
+            return (411,) if method == "POST" else (None, method, target, headers, b"")
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            return (400,)
+        if length > self.max_body:
+            return (413,)
+        return None, method, target, headers, await reader.readexactly(length)
+
+    async def handle(self, method, target, headers, body):
+        url = urlsplit(target)
+        if url.path != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        status = await self.verify(url, headers)
+        if status:
+            return status
+        try:
+            if 'ce-type' in headers:
+                message = PushMessage.from_cloudevent(headers, body)
+            else:
+                message = PushMessage.from_envelope(body)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("Unreadable push request: %s", e)
+            return 400
+        try:
+            await self.loop.run_in_executor(self.executor, self.callback, message)
+        except Exception as e:
+            logger.error("Callback failed on %s: %s", message.message_id, e)
+            return 503
+        return 204 if message.acked else 503
+
+    # Verification
+
+    async def verify(self, url, headers):
+        """None if the request may go through, else the status to refuse it with."""
+        if self.token:
+            given = parse_qs(url.query).get('token', [""])[0]
+            if not hmac.compare_digest(given.encode(), self.token.encode()):
+                return 403
+        if self.audience:
+            scheme, _, bearer = headers.get('authorization', '').partition(" ")
+            if scheme.lower() != "bearer" or not bearer:
+                return 401
+            expires = self.verified.get(bearer)
+            if expires is None or expires < time.time():
+                try:
+                    claims = await self.loop.run_in_executor(self.executor, self.check_oidc, bearer)
+                except Exception as e:
+                    logger.warning("Rejected push token: %s", e)
+                    return 403
+                if len(self.verified) > 1000:
+                    self.verified.clear()
+                self.verified[bearer] = claims['exp']
+        return None
+
+    def check_oidc(self, bearer):
+        from google.auth.transport import requests as google_requests
+        from google.oauth2 import id_token
+        if self.google_request is None:
+            self.google_request = google_requests.Request()
+        claims = id_token.verify_oauth2_token(bearer, self.google_request, audience=self.audience)
+        if self.service_account and (claims.get('email') != self.service_account or not claims.get('email_verified')):
+            raise ValueError(f"token is for {claims.get('email')}, not {self.service_account}")
+        return claims
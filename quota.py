@@ -0,0 +1,193 @@
+"""
+Client-side quota budget for the Google APIs.
+
+Every API call goes through call(api, func). It:
+  - takes a token from the bucket of the API's family ("calendar", "meet",
+    "workspaceevents", "pubsub"; the part of `api` before the first dot), waiting if the
+    bucket is empty, so a burst of calls at the top of the hour is spread out instead of
+    running into Google's per-minute quotas;
+  - shares one call between threads that ask for the same key at the same time;
+  - retries 429 and 5xx responses with exponential backoff and full jitter;
+  - records the call in metrics (google_api_seconds / google_api_errors_total).
+
+Throttling and long waits for tokens raise the pressure level, which halves the calendar
+poll rate per level (slowdown()); it falls back one level for every `calm` seconds without
+trouble. So under quota pressure the notifier polls less often instead of failing.
+
+The budget is module-level, like the metrics registry. Rates default to well under the
+published per-minute quotas, and can be changed with the "quota" section of
+notifier_config.json, e.g. {"quota": {"calendar": [5, 20]}} for 5 calls/s with bursts of
+20. use() swaps in another budget; unlimited() one without rate limits, as --emulate and
+benchmark.py run with.
+"""
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# family -> (calls per second, burst)
+DEFAULT_RATES = {
+    "calendar": (8, 40),            # Calendar: 600 queries/minute per user
+    "meet": (8, 40),                # Meet REST: 6000 reads/minute per project, less per user
+    "workspaceevents": (1.5, 20),   # Workspace Events: 100 writes/minute per project
+    "pubsub": (5, 10),              # admin calls (topics, IAM, subscriptions)
+}
+RETRYABLE = {"429", "500", "502", "503", "504"}
+
+THROTTLED = metrics.Counter("quota_throttled_total", "Calls that got 429 or 5xx and were retried, by API.")
+TOKEN_WAIT = metrics.Histogram("quota_token_wait_seconds", "Time spent waiting for a rate limiter token, by family.")
+COALESCED = metrics.Counter("quota_coalesced_total", "Calls answered by an identical call already in flight.")
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.stamp = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self, n=1):
+        """Take n tokens, sleeping until they are available. Returns the time spent waiting."""
+        waited = 0.0
+        # More than a burst is taken a burst at a time, so a big batch still pays for every call.
+        while n > self.burst:
+            waited += self._take(self.burst)
+            n -= self.burst
+        return waited + self._take(n)
+
+    def _take(self, n):
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return waited
+                wait = (n - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class QuotaBudget:
+    def __init__(self, rates=DEFAULT_RATES, max_retries=5, base_delay=0.5, max_delay=32,
+                 calm=120, max_level=4, clock=time.monotonic):
+        self.buckets = {family: TokenBucket(rate, burst, clock) for family, (rate, burst) in rates.items()}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.calm = calm
+        self.max_level = max_level
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.inflight = {}          # coalescing key -> Future
+        self.level = 0
+        self.last_trouble = None
+        self.random = random.Random()
+
+    def configure(self, rates):
+        """Override the rates of some families: {family: [calls per second, burst]}."""
+        for family, (rate, burst) in rates.items():
+            self.buckets[family] = TokenBucket(rate, burst, self.clock)
+
+    def _trouble(self):
+        with self.lock:
+            if self.level < self.max_level:
+                self.level += 1
+                logger.warning("Quota pressure: polling %dx slower", 2 ** self.level)
+            self.last_trouble = self.clock()
+
+    def slowdown(self):
+        """Factor to stretch the polling interval by: 1 when all is well, up to 2**max_level."""
+        with self.lock:
+            while self.level and self.clock() - self.last_trouble >= self.calm:
+                self.level -= 1
+                self.last_trouble += self.calm
+            return 2 ** self.level
+
+    def call(self, api, func, key=None, cost=1):
+        """
+        Run func() as a call to `api`, with rate limiting, retries and, if key is given,
+        coalescing. cost is the number of calls it counts as (a batch request counts its parts).
+        """
+        if key is None:
+            return self._call(api, func, cost)
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+        if not owner:
+            COALESCED.inc(api=api)
+            return future.result()
+        try:
+            result = self._call(api, func, cost)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+    def _call(self, api, func, cost=1):
+        family = api.split(".", 1)[0]
+        bucket = self.buckets.get(family)
+        attempt = 0
+        while True:
+            if bucket:
+                waited = bucket.acquire(cost)
+                if waited:
+                    TOKEN_WAIT.observe(waited, family=family)
+                    if waited > 1:
+                        self._trouble()
+            try:
+                with metrics.api_call(api):
+                    return func()
+            except Exception as e:
+                if metrics.error_code(e) not in RETRYABLE or attempt >= self.max_retries:
+                    raise
+                THROTTLED.inc(api=api)
+                self._trouble()
+                delay = self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                logger.info("%s failed with %s; retrying in %.1fs", api, metrics.error_code(e), delay)
+                time.sleep(delay)
+                attempt += 1
+
+
+BUDGET = QuotaBudget()
+
+
+def call(api, func, key=None, cost=1):
+    return BUDGET.call(api, func, key, cost)
+
+
+def slowdown():
+    return BUDGET.slowdown()
+
+
+def configure(rates):
+    BUDGET.configure(rates)
+
+
+def use(budget):
+    """Put budget in place of the module's. Returns the one it replaces."""
+    global BUDGET
+    previous, BUDGET = BUDGET, budget
+    return previous
+
+
+def unlimited():
+    """No rate limits (retries and coalescing stay), for the emulator and benchmarks, whose
+    fake APIs have no quota and whose clock may not be real time."""
+    return use(QuotaBudget(rates={}))
@@ -0,0 +1,141 @@
+"""
+Play a recording made with `meeting_notifier.py --record BASE` back through the Pub/Sub callback.
+
+    python replay.py recordings/meet-events-*.jsonl.gz              # at the recorded pace
+    python replay.py --speed 10 recordings/meet-events-*.jsonl      # ten times faster
+    python replay.py --speed 0 --profile hot.prof recordings/...    # as fast as possible, under cProfile
+    python replay.py --post http://localhost:8080/push recordings/... # POST them to a push receiver
+
+The rooms and meetings come from the recording, and participant lookups are answered from
+the identities the live run resolved, so no Google API is called. Nothing is played and no
+alert fires; the summary on stdout lists the joins the callback decided and how long it
+took to handle the messages. With --post the messages go, as Pub/Sub push requests, to a
+notifier running with --push-port instead, and the summary counts what it acked.
+"""
+
+import argparse
+import cProfile
+import http.client
+import json
+import logging
+import pstats
+import sys
+import time
+from urllib.parse import urlsplit
+
+from emulator import Emulator, FakeParticipant
+from event_log import ReplayMessage, read_records
+from meeting_notifier import make_callback
+from meeting_state import MeetingRecord, MeetingStore
+from participant_resolver import ParticipantResolver
+from push_receiver import push_envelope
+from rooms import Room
+
+logger = logging.getLogger(__name__)
+
+
+class JoinLog:
+    """Stands in for the AlertScheduler: the callback cancels a room's alert when it joins."""
+
+    def __init__(self):
+        self.joins = []
+
+    def cancel(self, key):
+        self.joins.append(key)
+
+
+class Poster:
+    """Stands in for the callback: sends each message to a push endpoint, as Pub/Sub would."""
+
+    def __init__(self, url):
+        self.url = urlsplit(url)
+        self.connection = http.client.HTTPConnection(self.url.netloc, timeout=30)
+
+    def __call__(self, message):
+        target = self.url.path + (f"?{self.url.query}" if self.url.query else "")
+        self.connection.request("POST", target, push_envelope(message), {"Content-Type": "application/json"})
+        response = self.connection.getresponse()
+        response.read()
+        if response.status in (102, 200, 201, 202, 204):
+            message.ack()
+        else:
+            message.nack()
+
+
+def replay(paths, speed=1.0, profiler=None, post=None):
+    emulator = Emulator()
+    participants = 0
+    for record in read_records(paths):
+        if record['type'] == 'participant':
+            emulator.meet.add_participant(FakeParticipant(record['name'], record['user'], record['display_name']))
+            participants += 1
+
+    meetings = MeetingStore()
+    joins = JoinLog()
+    resolver = ParticipantResolver(emulator.conference_records_client)
+    callback = Poster(post) if post else make_callback(meetings, joins, resolver)
+    rooms_by_email = {}
+    counts = {'messages': 0, 'acked': 0, 'nacked': 0, 'meeting_updates': 0, 'participants': participants}
+    busy = 0.0
+    first = None
+    start = time.monotonic()
+
+    for record in read_records(paths):
+        kind = record['type']
+        if kind == 'rooms':
+            rooms_by_email = {r['room_email']: Room(r['name'], r['calendar_id'], r['room_email'], "null",
+                                                    r['meet_user'], r['display_name'])
+                              for r in record['rooms']}
+        elif kind == 'meetings':
+            meetings.replace({m['space_id']: MeetingRecord.from_dict(m, rooms_by_email)
+                              for m in record['meetings']})
+            counts['meeting_updates'] += 1
+        elif kind == 'message':
+            if first is None:
+                first = record['t']
+            if speed:
+                delay = (record['t'] - first) / speed - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            message = ReplayMessage(record)
+            t0 = time.perf_counter()
+            if profiler:
+                profiler.enable()
+            callback(message)
+            if profiler:
+                profiler.disable()
+            busy += time.perf_counter() - t0
+            counts['messages'] += 1
+            counts['acked' if message.acked else 'nacked'] += 1
+
+    elapsed = time.monotonic() - start
+    return {**counts,
+            'joins': [list(key) for key in joins.joins],
+            'wall_seconds': round(elapsed, 3),
+            'callback_seconds': round(busy, 3),
+            'messages_per_sec': round(counts['messages'] / busy) if busy else None,
+            'participant_api_calls': resolver.api_calls}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded Pub/Sub events through the callback")
+    parser.add_argument("paths", nargs="+", help="recording files (.jsonl or .jsonl.gz)")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="1 = recorded pace, N = N times faster, 0 = as fast as possible")
+    parser.add_argument("--profile", metavar="FILE", help="profile the callback and save pstats to FILE")
+    parser.add_argument("--post", metavar="URL", help="POST the messages to this push endpoint instead")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(args.log_level)
+    logging.getLogger("meeting_notifier").setLevel(args.log_level)
+
+    profiler = cProfile.Profile() if args.profile else None
+    result = replay(args.paths, args.speed, profiler, args.post)
+    if profiler:
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(20)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Registry of the conference rooms watched by one notifier process.
+
+notifier_config.json lists the rooms:
+
+    {
+      "rooms": [
+        {"name": "Lobby",
+         "calendar_id": "c_...@resource.calendar.google.com",
+         "room_email": "c_...@resource.calendar.google.com",
+         "alert_sink": "aplay -D plughw:1",
+         "meet_user": "users/1234567890",
+         "display_name": "Lobby",
+         "timezone": "Europe/London"}
+      ]
+    }
+
+room_email defaults to calendar_id (for a room resource they are the same address) and
+alert_sink picks how the alert is played on that room's speaker: aplay, paplay, mpg123,
+afplay, null or file:<path> (see alert_player.py). Meet events don't carry email
+addresses, so a participant is recognized as the room by its Meet user id (meet_user) or,
+failing that, by display_name, which defaults to name. timezone decides where the room's
+day starts; it defaults to the top-level "timezone", else America/New_York. The old
+single-room form, {"monitor_calendar_id": ...}, is still accepted.
+"""
+
+import sys
+
+DEFAULT_ALERT_SINK = "afplay" if sys.platform == "darwin" else "aplay"
+DEFAULT_TIMEZONE = "America/New_York"
+
+
+class Room:
+    def __init__(self, name, calendar_id, room_email=None, alert_sink=None,
+                 meet_user=None, display_name=None, timezone=None):
+        self.name = name
+        self.calendar_id = calendar_id
+        self.room_email = (room_email or calendar_id).lower()
+        self.alert_sink = alert_sink or DEFAULT_ALERT_SINK
+        self.meet_user = meet_user
+        self.display_name = display_name or name
+        self.timezone = timezone or DEFAULT_TIMEZONE
+        self.sync = None        # CalendarSync for this room's calendar
+
+    def __repr__(self):
+        return f"<Room {self.name} {self.room_email}>"
+
+    def matches(self, identity):
+        """True if a ParticipantIdentity is this room."""
+        if self.meet_user and identity.user:
+            return identity.user == self.meet_user
+        return identity.display_name == self.display_name
+
+
+def load_rooms(config, default_room_email=None):
+    if 'rooms' in config:
+        rooms = [Room(r.get('name', r['calendar_id']),
+                      r['calendar_id'],
+                      r.get('room_email'),
+                      r.get('alert_sink'),
+                      r.get('meet_user'),
+                      r.get('display_name'),
+                      r.get('timezone', config.get('timezone')))
+                 for r in config['rooms']]
+    else:
+        calendar_id = config['monitor_calendar_id']
+        rooms = [Room(calendar_id, calendar_id, default_room_email, timezone=config.get('timezone'))]
+    emails = [r.room_email for r in rooms]
+    if len(set(emails)) != len(emails):
+        raise ValueError("notifier_config.json lists the same room more than once")
+    return rooms
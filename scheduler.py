@@ -0,0 +1,148 @@
+"""
+Timer-driven alerting.
+
+Instead of checking every meeting every few seconds, the AlertScheduler keeps a heap of the
+moments when an alert could become due: a meeting's start (plus a grace period), and then
+every `repeat` seconds until the meeting ends. A single thread sleeps until the earliest of
+those moments. When the Pub/Sub callback sees the room join it calls cancel(), which drops
+the pending alert without touching the heap; the stale entry is skipped when it comes up.
+
+refresh_interval() picks how long the main loop should wait before polling the calendars
+again: often near a meeting boundary, rarely when nothing is coming up.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AlertScheduler:
+    def __init__(self, on_due, grace=0, repeat=5, clock=time.time, wait=None):
+        """
+        :param on_due: called as on_due(key) when an alert is due. Return True if the alert
+                       fired and should be repeated, False if it is no longer needed.
+        :param wait: wait(cv, seconds) blocks on cv for up to `seconds` of clock time. Only
+                     needed when clock doesn't run at wall-clock speed (see emulator.py).
+        """
+        self.on_due = on_due
+        self.grace = grace
+        self.repeat = repeat
+        self.clock = clock
+        self.wait = wait or (lambda cv, seconds: cv.wait(seconds))
+        self.heap = []                  # (when, seq, key, generation)
+        self.plans = {}                 # key -> (start, end, generation)
+        self.seq = itertools.count()
+        self.generations = itertools.count(1)
+        self.cv = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def schedule(self, key, start, end):
+        """Alert for key (e.g. (space_id, room_email)) between epoch times start and end."""
+        with self.cv:
+            plan = self.plans.get(key)
+            if plan and plan[:2] == (start, end):
+                return
+            generation = next(self.generations)
+            self.plans[key] = (start, end, generation)
+            heapq.heappush(self.heap, (start + self.grace, next(self.seq), key, generation))
+            self.cv.notify()
+
+    def cancel(self, key):
+        with self.cv:
+            if self.plans.pop(key, None):
+                logger.debug("Cancelled alert for %s", key)
+
+    def keys(self):
+        with self.cv:
+            return list(self.plans)
+
+    def next_due(self):
+        """Epoch time of the next live alert, or None."""
+        with self.cv:
+            self._drop_stale()
+            return self.heap[0][0] if self.heap else None
+
+    def _drop_stale(self):
+        while self.heap:
+            _, _, key, generation = self.heap[0]
+            plan = self.plans.get(key)
+            if plan and plan[2] == generation:
+                return
+            heapq.heappop(self.heap)
+
+    def _pop_due(self):
+        """Wait until an alert is due and return its key, or None when stopped."""
+        with self.cv:
+            while not self.stopped:
+                self._drop_stale()
+                if not self.heap:
+                    self.cv.wait()
+                    continue
+                delay = self.heap[0][0] - self.clock()
+                if delay > 0:
+                    self.wait(self.cv, delay)
+                    continue
+                when, _, key, generation = heapq.heappop(self.heap)
+                start, end, _ = self.plans[key]
+                if when >= end:
+                    del self.plans[key]
+                    continue
+                return key, when, generation
+            return None
+
+    def _rearm(self, key, when, generation):
+        with self.cv:
+            plan = self.plans.get(key)
+            if plan is None or plan[2] != generation:
+                return
+            nxt = max(when + self.repeat, self.clock())
+            if nxt < plan[1]:
+                heapq.heappush(self.heap, (nxt, next(self.seq), key, generation))
+            else:
+                del self.plans[key]
+
+    def run(self):
+        while True:
+            due = self._pop_due()
+            if due is None:
+                return
+            key, when, generation = due
+            try:
+                repeat = self.on_due(key)
+            except Exception as e:
+                logger.error("Alert for %s failed: %s", key, e)
+                repeat = True
+            if repeat:
+                self._rearm(key, when, generation)
+            else:
+                self.cancel(key)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="alert-scheduler", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.cv:
+            self.stopped = True
+            self.cv.notify()
+
+
+def refresh_interval(now, timeline, fast=5, normal=60, slow=600, near=300, soon=3600):
+    """
+    Seconds to wait before the next calendar poll. timeline is the Timeline of the meetings
+    being watched.
+    """
+    nearest = timeline.nearest(now, behind=near)
+    if nearest is None:
+        return slow
+    if nearest <= near:
+        return fast
+    if nearest <= soon:
+        return normal
+    return min(slow, max(normal, nearest - soon))
@@ -0,0 +1,128 @@
+"""
+Split the rooms among cooperating workers by consistent hashing.
+
+Each worker keeps a lease alive in a shared LeaseStore and builds a HashRing over the
+workers whose leases haven't run out; a room belongs to the worker its email hashes to.
+A worker that stops renewing (it died, or can't reach the store) drops out once its lease
+runs out after `ttl` seconds, and the others take over its rooms. Each worker is put on
+the ring `vnodes` times, so only the rooms of the worker that left or joined move.
+
+A worker that can't reach the store keeps the rooms it had, so a store outage may have two
+workers watching a room for a while (duplicate alerts) but never none.
+
+LeaseStore is a local stand-in: an SQLite table that every worker on the host, or on a
+filesystem with working SQLite locks, opens. Anything with the same heartbeat(), live()
+and leave() methods, e.g. a table in a real database, can take its place.
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from bisect import bisect_right
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WORKERS = metrics.Gauge("shard_workers", "Workers holding a live lease.")
+
+
+def ring_hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    __slots__ = ('hashes', 'members')
+
+    def __init__(self, members=(), vnodes=64):
+        points = sorted((ring_hash(f"{member}#{i}"), member) for member in members for i in range(vnodes))
+        self.hashes = [h for h, _ in points]
+        self.members = [member for _, member in points]
+
+    def owner(self, key):
+        """The member that key belongs to, or None if there are none."""
+        if not self.members:
+            return None
+        return self.members[bisect_right(self.hashes, ring_hash(key)) % len(self.members)]
+
+
+class LeaseStore:
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS leases (worker TEXT PRIMARY KEY, expires REAL NOT NULL)")
+
+    def __repr__(self):
+        return f"<LeaseStore {self.path}>"
+
+    def heartbeat(self, worker, ttl):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO leases (worker, expires) VALUES (?, ?)",
+                              (worker, self.clock() + ttl))
+
+    def live(self):
+        """The workers whose leases haven't run out, sorted."""
+        with self.lock:
+            rows = self.conn.execute("SELECT worker FROM leases WHERE expires > ? ORDER BY worker",
+                                     (self.clock(),)).fetchall()
+        return [worker for (worker,) in rows]
+
+    def leave(self, worker):
+        with self.lock:
+            self.conn.execute("DELETE FROM leases WHERE worker=?", (worker,))
+
+
+class ShardCoordinator:
+    def __init__(self, store, worker, ttl=30, interval=10, vnodes=64):
+        self.store = store
+        self.worker = worker
+        self.ttl = ttl
+        self.interval = interval
+        self.vnodes = vnodes
+        self.members = ()
+        self.ring = HashRing()
+        self.changed = threading.Event()    # set when the membership changes
+        self.stopped = threading.Event()
+        self.thread = None
+        WORKERS.set_function(lambda: len(self.members))
+
+    def __repr__(self):
+        return f"<ShardCoordinator {self.worker} of {len(self.members)}>"
+
+    def start(self):
+        """Take a lease (raising if the store can't be reached) and keep it renewed."""
+        self.beat()
+        self.thread = threading.Thread(target=self.run, name="shard-lease", daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.beat()
+            except Exception as e:
+                logger.error("Could not renew the lease of %s: %s", self.worker, e)
+
+    def beat(self):
+        self.store.heartbeat(self.worker, self.ttl)
+        members = tuple(sorted(set(self.store.live()) | {self.worker}))
+        if members != self.members:
+            logger.info("Workers: %s (this is %s)", ", ".join(members), self.worker)
+            self.members = members
+            self.ring = HashRing(members, self.vnodes)
+            self.changed.set()
+
+    def owns(self, room):
+        return self.ring.owner(room.room_email) == self.worker
+
+    def mine(self, rooms):
+        return [room for room in rooms if self.owns(room)]
+
+    def stop(self):
+        self.stopped.set()
+        self.store.leave(self.worker)
@@ -0,0 +1,102 @@
+"""
+Cache of calendar conferenceId -> Meet space name ("spaces/...").
+
+The mapping doesn't change for the life of a meeting, so once a space is resolved the main
+loop shouldn't have to ask Meet again. Entries expire after a TTL, the least recently used
+entry is evicted when the cache is full, and failed lookups are remembered for a shorter
+time so a broken event doesn't cost an API call on every loop. Each entry records a
+version of the event's conference, its conferenceData.signature; when the conference
+changes, the entry is dropped and resolved again.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class SpaceCache:
+    def __init__(self, ttl=6 * 3600, negative_ttl=60, max_entries=1024, clock=time.monotonic):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = OrderedDict()    # conferenceId -> (space_name or None, expires, version)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _lookup(self, conference_id, version):
+        """Return (found, space_name) and update the counters."""
+        with self.lock:
+            entry = self.entries.get(conference_id)
+            if entry is not None:
+                space_name, expires, entry_version = entry
+                if expires > self.clock() and entry_version == version:
+                    self.entries.move_to_end(conference_id)
+                    if space_name is None:
+                        self.negative_hits += 1
+                    else:
+                        self.hits += 1
+                    return True, space_name
+                del self.entries[conference_id]
+            self.misses += 1
+            return False, None
+
+    def put(self, conference_id, space_name, version=None):
+        ttl = self.ttl if space_name is not None else self.negative_ttl
+        with self.lock:
+            self.entries[conference_id] = (space_name, self.clock() + ttl, version)
+            self.entries.move_to_end(conference_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, conference_id, version, resolve):
+        """
+        Return the space name for conference_id, calling resolve() on a miss.
+        If resolve() raises, the error is logged, remembered for negative_ttl and None is returned.
+        """
+        found, space_name = self._lookup(conference_id, version)
+        if found:
+            return space_name
+        try:
+            space_name = resolve()
+        except Exception as err:
+            logger.error(f"Error retrieving space for {conference_id}: {err}")
+            space_name = None
+        self.put(conference_id, space_name, version)
+        return space_name
+
+    def dump(self):
+        """Entries as [conferenceId, space_name, seconds_left, version] lists, for StateDB."""
+        now = self.clock()
+        with self.lock:
+            return [[cid, space_name, expires - now, version]
+                    for cid, (space_name, expires, version) in self.entries.items()]
+
+    def load(self, entries, age=0):
+        """Restore entries from dump() that was taken `age` seconds ago."""
+        now = self.clock()
+        with self.lock:
+            for cid, space_name, seconds_left, version in entries:
+                if seconds_left - age > 0:
+                    self.entries[cid] = (space_name, now + seconds_left - age, version)
+
+    def invalidate(self, conference_id):
+        with self.lock:
+            self.entries.pop(conference_id, None)
+
+    def stats(self):
+        return {'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'negative_hits': self.negative_hits,
+                'evictions': self.evictions}
@@ -0,0 +1,85 @@
+"""
+Local state that lets the notifier restart warm.
+
+A small SQLite key/value table holds, as JSON, everything that is expensive to rebuild: the
+Pub/Sub topic and subscription we set up, the Workspace Events subscriptions, resolved
+spaces, meeting join states and each calendar's sync token and event index. Every save is
+one transaction, so a crash leaves either the old state or the new one, never a mix.
+
+Cloud resources are recorded *before* they are created (state "pending") and marked
+"active" afterwards. A restart that finds a pending resource knows it may exist and
+adopts it rather than creating another one, so a crash at any point can't orphan it.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = "notifier_state.db"
+
+
+class StateDB:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS state "
+                          "(key TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL)")
+
+    def __repr__(self):
+        return f"<StateDB {self.path}>"
+
+    def get(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM state WHERE key=?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def put(self, key, value):
+        self.put_many({key: value})
+
+    def put_many(self, values):
+        """Write several keys in one transaction."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany("INSERT OR REPLACE INTO state (key, value, updated) VALUES (?, ?, ?)",
+                                      [(k, json.dumps(v), now) for k, v in values.items()])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, *keys):
+        with self.lock:
+            self.conn.executemany("DELETE FROM state WHERE key=?", [(k,) for k in keys])
+
+    def keys(self, prefix=""):
+        with self.lock:
+            rows = self.conn.execute("SELECT key FROM state WHERE substr(key, 1, ?)=? ORDER BY key",
+                                     (len(prefix), prefix)).fetchall()
+        return [r[0] for r in rows]
+
+    def resource(self, kind):
+        """Return the recorded {"name", "state"} of a cloud resource, or None."""
+        return self.get(f"resource:{kind}")
+
+    def begin_resource(self, kind, name):
+        """Record that we are about to create a resource."""
+        self.put(f"resource:{kind}", {"name": name, "state": "pending"})
+
+    def commit_resource(self, kind, name):
+        self.put(f"resource:{kind}", {"name": name, "state": "active"})
+
+    def forget_resource(self, kind):
+        self.delete(f"resource:{kind}")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,278 @@
+"""
+Keep Workspace Events subscriptions in line with the meetings being watched.
+
+Each cycle the reconciler lists the subscriptions that each organizer already has (all
+pages), compares them with the active meetings, and then:
+  - creates a subscription only for meetings that have none,
+  - renews (patches the ttl of) subscriptions that expire within renew_margin,
+  - deletes subscriptions for meetings that are no longer active, and, with orphans,
+    subscriptions whose topic has been deleted.
+Only subscriptions on exactly topic_path count as ours: a shard worker's topic
+(meet-events-<name>) or another script's shares our topic's name as a prefix, and its
+subscriptions are live.
+Listing costs one call per organizer per page, so it's skipped when the set of meetings
+hasn't changed and the last listing is less than min_interval old. An organizer's creates,
+renewals and deletes go out together as one batch request (up to batch_size calls each);
+if the batch endpoint fails as a whole, the reconciler sends them one by one from then on.
+Given an executor, organizers are reconciled side by side; one that is still running at the
+deadline keeps its previous subscriptions for the cycle, and is listed again next cycle.
+
+delete_orphaned_pubsub_subscriptions() cleans up the Pub/Sub side: subscriptions whose
+topic has been deleted.
+"""
+
+import logging
+import time
+from concurrent.futures import wait
+from datetime import datetime, timedelta, timezone
+
+from googleapiclient.errors import HttpError
+
+import metrics
+import quota
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = [
+    "google.workspace.meet.participant.v2.joined",
+    "google.workspace.meet.participant.v2.left",
+    "google.workspace.meet.conference.v2.started",
+    "google.workspace.meet.conference.v2.ended",
+]
+LIST_FILTER = f'event_types:"{EVENT_TYPES[0]}"'
+MEET_PREFIX = "//meet.googleapis.com/"
+
+
+def subscription_body(space_id, topic_path, ttl):
+    return {
+        "targetResource": f"{MEET_PREFIX}{space_id}",
+        "eventTypes": EVENT_TYPES,
+        "payloadOptions": {
+            "includeResource": True,
+        },
+        "notificationEndpoint": {
+            "pubsubTopic": topic_path
+        },
+        "ttl": f"{ttl}s",
+    }
+
+
+def operation_subscription_name(op):
+    """create() returns a long-running operation; the subscription is in its response or metadata."""
+    for part in ('response', 'metadata'):
+        name = op.get(part, {}).get('name') or op.get(part, {}).get('subscription', {}).get('name')
+        if name:
+            return name
+    return op.get('name')
+
+
+class SubscriptionReconciler:
+    def __init__(self, pool, topic_path, orphans=False, ttl=86400,
+                 renew_margin=3600, min_interval=300, batch_size=50, executor=None, clock=time.time):
+        """
+        :param orphans: also delete subscriptions whose topic has been deleted.
+        """
+        self.pool = pool
+        self.topic_path = topic_path
+        self.orphans = orphans
+        self.ttl = ttl
+        self.renew_margin = timedelta(seconds=renew_margin)
+        self.min_interval = min_interval
+        self.batch_size = batch_size    # 0: no batching
+        self.executor = executor
+        self.clock = clock
+        self.pending = {}           # subject -> reconcile that outlived its deadline
+        self.subscriptions = {}     # space_id -> subscription name
+        self.subjects = set()       # organizers we have created subscriptions for
+        self.last_spaces = None
+        self.last_run = 0
+
+    def state(self):
+        return {'subscriptions': self.subscriptions,
+                'subjects': list(self.subjects),
+                'spaces': sorted(self.last_spaces or []),
+                'last_run': self.last_run}
+
+    def restore(self, state):
+        """Trust what a previous run recorded until min_interval has passed since it last listed."""
+        self.subscriptions = state['subscriptions']
+        self.subjects = set(state['subjects'])
+        self.last_spaces = frozenset(state['spaces'])
+        self.last_run = state['last_run']
+
+    def list_subscriptions(self, subject):
+        service = self.pool.workspace_events(subject)
+        subs = []
+        page_token = None
+        while True:
+            response = quota.call("workspaceevents.subscriptions.list",
+                                  service.subscriptions().list(filter=LIST_FILTER, pageToken=page_token).execute)
+            subs.extend(response.get("subscriptions", []))
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return subs
+
+    def _ours(self, sub):
+        topic = sub.get("notificationEndpoint", {}).get("pubsubTopic", "")
+        return topic == self.topic_path or (self.orphans and topic.endswith("_deleted-topic_"))
+
+    def _expiring(self, sub, now):
+        expire = sub.get("expireTime")
+        if not expire:
+            return False
+        return datetime.fromisoformat(expire) - now < self.renew_margin
+
+    def reconcile(self, meetings, force=False, deadline=None):
+        """
+        meetings maps space_id -> MeetingRecord (only .organizer is used).
+        Returns space_id -> subscription name for the meetings that have one.
+        deadline (seconds) only applies with an executor.
+        """
+        spaces = frozenset(meetings)
+        if not force and spaces == self.last_spaces and self.clock() - self.last_run < self.min_interval:
+            return self.subscriptions
+        self.last_spaces = spaces
+        self.last_run = self.clock()
+
+        # Without domain-wide delegation every organizer's calls go through the one user
+        # account, which sees all of our subscriptions: reconcile them all as one subject,
+        # or each organizer's pass would delete the others' subscriptions as stale.
+        delegated = getattr(self.pool, 'use_sa', True)
+        wanted = {}                 # subject -> {space_id}
+        for space_id, meeting in meetings.items():
+            wanted.setdefault(meeting.organizer if delegated else None, set()).add(space_id)
+        self.subjects |= set(wanted)
+
+        now = datetime.now(timezone.utc)
+        subjects = sorted(self.subjects, key=str)
+        if self.executor is None:
+            results = {subject: self._reconcile_subject(subject, wanted.get(subject, set()), now)
+                       for subject in subjects}
+        else:
+            futures = {}
+            for subject in subjects:
+                future = self.pending.pop(subject, None)
+                if future is not None and not future.done():
+                    self.pending[subject] = future
+                else:
+                    futures[subject] = self.executor.submit(self._reconcile_subject, subject,
+                                                            wanted.get(subject, set()), now)
+            done, _ = wait(futures.values(), timeout=deadline)
+            results = {}
+            for subject, future in futures.items():
+                if future in done:
+                    results[subject] = future.result()
+                else:
+                    self.pending[subject] = future
+
+        found = {}
+        counts = {'created': 0, 'renewed': 0, 'deleted': 0}
+        for subject in subjects:
+            want = wanted.get(subject, set())
+            if subject not in results:
+                logger.warning("Subscriptions for %s are late; keeping the previous ones", subject)
+                metrics.CYCLE_LATE.inc(work="subscriptions")
+                found.update({sid: self.subscriptions[sid] for sid in want if sid in self.subscriptions})
+                self.last_spaces = None
+                continue
+            subject_found, subject_counts = results[subject]
+            found.update(subject_found)
+            for counter, n in subject_counts.items():
+                counts[counter] += n
+            if not want:
+                self.subjects.discard(subject)
+
+        self.subscriptions = found
+        if any(counts.values()):
+            logger.info("Subscriptions: %d active, %s", len(found), counts)
+        return found
+
+    def _reconcile_subject(self, subject, want, now):
+        """Bring one organizer's subscriptions in line with want. Returns (space_id -> name, counts)."""
+        service = self.pool.workspace_events(subject)
+        found = {}
+        counts = {'created': 0, 'renewed': 0, 'deleted': 0}
+        try:
+            existing = self.list_subscriptions(subject)
+        except Exception as e:
+            logger.warning("Could not list subscriptions for %s: %s", subject, e)
+            return {sid: self.subscriptions[sid] for sid in want if sid in self.subscriptions}, counts
+
+        calls = []              # (request, what, target, counter)
+        for sub in existing:
+            if not self._ours(sub):
+                continue
+            space_id = sub.get("targetResource", "").removeprefix(MEET_PREFIX)
+            if (space_id in want and space_id not in found and sub.get("state", "ACTIVE") == "ACTIVE"
+                    and sub.get("notificationEndpoint", {}).get("pubsubTopic") == self.topic_path):
+                found[space_id] = sub["name"]
+                if self._expiring(sub, now):
+                    calls.append((service.subscriptions().patch(
+                        name=sub["name"], updateMask="ttl", body={"ttl": f"{self.ttl}s"}),
+                        "patch", sub["name"], 'renewed'))
+            else:
+                calls.append((service.subscriptions().delete(name=sub["name"]), "delete", sub["name"], 'deleted'))
+
+        for space_id in sorted(want - set(found)):
+            calls.append((service.subscriptions().create(
+                body=subscription_body(space_id, self.topic_path, self.ttl)),
+                "create", space_id, 'created'))
+
+        for (_, what, target, _), result in zip(calls, self._execute(service, calls, counts)):
+            if what == "create" and result is not None:
+                found[target] = operation_subscription_name(result)
+
+        return found, counts
+
+    def _execute(self, service, calls, counts):
+        """Run (request, what, target, counter) calls, batched if there are several. Returns their results (None if failed)."""
+        if len(calls) < 2 or not self.batch_size:
+            return [self._call(request, what, target, counts, counter) for request, what, target, counter in calls]
+        results = [None] * len(calls)
+
+        def done(request_id, response, exception):
+            i = int(request_id)
+            _, what, target, counter = calls[i]
+            if exception is not None:
+                metrics.API_ERRORS.inc(api=f"workspaceevents.subscriptions.{what}", code=metrics.error_code(exception))
+                logger.warning("Could not %s subscription for %s: %s", what, target, exception)
+            else:
+                results[i] = response
+                counts[counter] += 1
+
+        for lo in range(0, len(calls), self.batch_size):
+            batch = service.new_batch_http_request(callback=done)
+            for i in range(lo, min(lo + self.batch_size, len(calls))):
+                batch.add(calls[i][0], request_id=str(i))
+            try:
+                quota.call("workspaceevents.batch", batch.execute, cost=min(self.batch_size, len(calls) - lo))
+            except HttpError as e:
+                logger.warning("Batch request failed (%s); sending subscription calls one by one", e)
+                self.batch_size = 0
+                return results[:lo] + self._execute(service, calls[lo:], counts)
+        return results
+
+    def _call(self, request, what, target, counts, counter):
+        try:
+            result = quota.call(f"workspaceevents.subscriptions.{what}", request.execute)
+            counts[counter] += 1
+            return result
+        except HttpError as e:
+            logger.warning("Could not %s subscription for %s: %s", what, target, e)
+            return None
+
+
+def delete_orphaned_pubsub_subscriptions(subscriber, project_id, prefix=None):
+    """Delete Pub/Sub subscriptions whose topic was deleted. Returns how many were deleted."""
+    deleted = 0
+    subs = quota.call("pubsub.list_subscriptions",
+                      lambda: list(subscriber.list_subscriptions(request={"project": f"projects/{project_id}"})))
+    for sub in subs:
+        if prefix and not sub.name.split("/")[-1].startswith(prefix):
+            continue
+        if sub.topic.endswith("_deleted-topic_"):
+            logger.info(f"Deleting orphaned subscription: {sub.name}")
+            quota.call("pubsub.delete_subscription",
+                       lambda: subscriber.delete_subscription(request={"subscription": sub.name}))
+            deleted += 1
+    return deleted
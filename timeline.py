@@ -0,0 +1,63 @@
+"""
+Meeting times as epoch seconds, parsed once, and a sorted index over them.
+
+The Calendar API gives times as ISO strings in the calendar's own offset ("-04:00"), so
+they can't be compared as strings with a UTC "Z" time, and parsing them again on every
+check is wasted work. epoch() turns one into integer epoch seconds when the event is read.
+
+Timeline indexes meetings across all rooms by start and end:
+  - live(now) returns the meetings with start <= now < end. It bisects the sorted starts and
+    looks back no further than the longest meeting, so it costs O(log n) plus the meetings
+    that started within that span, not a pass over every meeting.
+  - next_boundary(now) and nearest(now, behind) bisect the sorted starts and ends.
+It is built once per calendar refresh (O(n log n)) and never changed, so any thread can
+query the current one without a lock.
+"""
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+
+
+def epoch(iso):
+    """ISO date-time (or all-day date) -> integer epoch seconds. Naive times are taken as UTC."""
+    when = datetime.fromisoformat(iso)
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return int(when.timestamp())
+
+
+class Timeline:
+    __slots__ = ('starts', 'ends', 'items', 'longest', 'boundaries')
+
+    def __init__(self, entries=()):
+        """entries: (start, end, item) triples, start and end in epoch seconds."""
+        entries = sorted(entries, key=lambda entry: entry[0])
+        self.starts = [start for start, _, _ in entries]
+        self.ends = [end for _, end, _ in entries]
+        self.items = [item for _, _, item in entries]
+        self.longest = max((end - start for start, end, _ in entries), default=0)
+        self.boundaries = sorted(self.starts + self.ends)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return f"<Timeline {len(self.items)} meetings>"
+
+    def live(self, now):
+        """Items whose meeting is under way at now."""
+        lo = bisect_left(self.starts, now - self.longest)
+        hi = bisect_right(self.starts, now)
+        return [self.items[i] for i in range(lo, hi) if self.ends[i] > now]
+
+    def next_boundary(self, now):
+        """The first start or end after now, or None."""
+        i = bisect_right(self.boundaries, now)
+        return self.boundaries[i] if i < len(self.boundaries) else None
+
+    def nearest(self, now, behind=0):
+        """Seconds to the closest start or end, counting only those after now - behind. None if there are none."""
+        lo = bisect_left(self.boundaries, now - behind)
+        i = bisect_left(self.boundaries, now, lo)
+        near = [abs(self.boundaries[j] - now) for j in (i - 1, i) if lo <= j < len(self.boundaries)]
+        return min(near) if near else None